@@ -0,0 +1,144 @@
+"""
+Scan throughput benchmark. Drives `CommandRunner.escan`, `ascan`, `a2scan` and `mscan` against the RSM500 emulator and
+reports for each scan and scan length:
+
+- points per second;
+- dead time per point (wall time of a point minus its exposure);
+- serial transactions (write/read round trips) and frames (commands) per point, so the batching of the commands
+  is seen as fewer transactions for the same number of frames;
+- peak of the memory allocated by Python during the scan (tracemalloc).
+
+Scans, whose moves would exceed the limits of the motors in settings.ini, are skipped and reported as skipped.
+
+Results are written as JSON, so that runs can be compared with each other. Run from the root of the repository:
+
+    python -m benchmarks.scan_throughput --sizes 100 1000 10000 --output bench.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import serial
+
+from src.command_run import CommandRunner
+from src.config import Settings, MOTOR_1
+from src.error_types import MotorException
+from src.rsm500 import RSMController
+from src.rsm500.emulator import RSMEmulator
+
+EXPOSURE = 0.1      # minimal exposure of the detectors, s
+
+# arguments of the CommandRunner modes for the given number of points
+SCANS = {
+    'escan': lambda n: (0., n, 0.001, EXPOSURE),
+    'ascan': lambda n: (MOTOR_1, 0., n, 0.01125, EXPOSURE),
+    'a2scan': lambda n: (0., n, 0.01125, EXPOSURE),
+    'mscan': lambda n: (EXPOSURE, 30, n),
+}
+
+
+def run_scan(cr: CommandRunner, emulator: RSMEmulator, scan: str, points: int, trace_memory: bool) -> dict:
+    transactions, frames = emulator.transactions, emulator.frames
+    if trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    getattr(cr, scan)(*SCANS[scan](points))
+    wall_time = time.perf_counter() - start
+
+    memory_peak = None
+    if trace_memory:
+        memory_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    exposure_time = points * EXPOSURE / emulator.time_scale
+    return {
+        'scan': scan,
+        'points': points,
+        'wall_time': wall_time,
+        'points_per_second': points / wall_time,
+        'dead_time_per_point': (wall_time - exposure_time) / points,
+        'transactions_per_point': (emulator.transactions - transactions) / points,
+        'frames_per_point': (emulator.frames - frames) / points,
+        'memory_peak_bytes': memory_peak,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Scan throughput benchmark on the RSM500 emulator')
+    parser.add_argument('--scans', nargs='+', default=list(SCANS), choices=list(SCANS))
+    parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000])
+    parser.add_argument('--baudrate', type=int, default=19200)
+    parser.add_argument('--no-latency', action='store_true', help='do not emulate latency of the line')
+    parser.add_argument('--time-scale', type=float, default=1.,
+                        help='how many times the emulated motors and exposure run faster than real time, '
+                             'values above 1 distort the waiting for the expected end of moves and counts')
+    parser.add_argument('--no-memory', action='store_true', help='do not trace memory, it slows down the scans')
+    parser.add_argument('--output', default='bench_output.json')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='rsm_bench_')
+    data_dir = os.path.join(work_dir, 'data')
+    os.mkdir(data_dir)
+    output = os.path.abspath(args.output)
+
+    # copy of the settings, so the absolute motor positions of the instrument are not changed
+    path_to_settings_ini = os.path.join(work_dir, 'settings.ini')
+    shutil.copy(Settings.path_to_settings_ini, path_to_settings_ini)
+    settings = Settings(path_to_settings_ini)
+    settings.path_to_datafiles = data_dir + os.sep
+
+    emulator = RSMEmulator(baudrate=args.baudrate, line_latency=not args.no_latency,
+                           step_rates=settings.get_motor_speeds(), time_scale=args.time_scale, seed=0)
+    RSMController.set_port(serial.Serial(emulator.open_pty(), baudrate=args.baudrate))
+
+    cwd = os.getcwd()
+    os.chdir(work_dir)   # the work log is written to the current directory
+    results = []
+    try:
+        cr = CommandRunner(settings)
+        cr.scan.live_plot = False
+
+        for scan in args.scans:
+            for points in args.sizes:
+                try:
+                    result = run_scan(cr, emulator, scan, points, not args.no_memory)
+                except MotorException as message:
+                    if tracemalloc.is_tracing():
+                        tracemalloc.stop()
+                    results.append({'scan': scan, 'points': points, 'skipped': str(message)})
+                    print(f'{scan:>7} {points:>6} points: skipped, {message}')
+                    continue
+                results.append(result)
+                print(f'{scan:>7} {points:>6} points: {result["points_per_second"]:8.1f} points/s, '
+                      f'dead time {1000 * result["dead_time_per_point"]:7.2f} ms/point, '
+                      f'{result["transactions_per_point"]:5.1f} transactions/point, '
+                      f'{result["frames_per_point"]:5.1f} frames/point')
+    finally:
+        os.chdir(cwd)
+        emulator.close()
+        settings.close()    # the positions are saved before the work directory is removed
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(output, 'w') as file:
+        json.dump({
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'baudrate': args.baudrate,
+            'line_latency': not args.no_latency,
+            'time_scale': args.time_scale,
+            'exposure': EXPOSURE,
+            'results': results,
+        }, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 import re
+import sys
 
 import serial
 
@@ -13,6 +14,9 @@ def main():
     available modes are presented in the CommandRunner().modes dictionary of the command_run.py module. To close the
     program, one should input 'close', 'quit', 'exit', 'c' or 'q'.
 
+    If the path to a script is given as the argument (python run.py night.txt), the script is run as a queue of
+    commands and the program exits.
+
     :return: None
     """
     s = Settings()  # global settings of the program
@@ -21,6 +25,10 @@ def main():
     RSMController.set_port(serial.Serial(port=s.port, baudrate=s.baudrate))
     cr = CommandRunner(s)
 
+    if len(sys.argv) > 1:
+        cr.run_command('queue', sys.argv[1])
+        return
+
     while True:
         # extraction from the command the mode name and arguments
         mode, *args = re.sub('\s+', ' ', input('> ').strip()).split(' ')
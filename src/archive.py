@@ -0,0 +1,245 @@
+import json
+import os
+import struct
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+
+class ArchiveWriter:
+    """
+    Writer of the binary scan archive (.rsmb). The file consists of a fixed prefix, a JSON header with the metadata
+    and the description of the columns, and fixed-size little-endian records appended one per point:
+
+        prefix:  b'RSMB', version (uint16), reserved (uint16), length of the header (uint32)
+        header:  JSON, padded with spaces to a multiple of 8 bytes
+        records: position (float64), counters (uint32 by default)
+
+    The number of points is determined by the size of the file, so the file is valid after each appended record and
+    a partially written record is ignored.
+    """
+    MAGIC = b'RSMB'
+    VERSION = 1
+    PREFIX = struct.Struct('<4sHHI')
+    EXTENSION = '.rsmb'
+
+    def __init__(self, path: str, meta_data: dict, index_name: str, columns: list, dtypes: list = None,
+                 index: 'ArchiveIndex' = None):
+        """
+
+        :param path: path to the archive file
+        :param meta_data: metadata of the scan
+        :param index_name: name of the position column
+        :param columns: names of the columns
+        :param dtypes: numpy types of the columns, uint32 by default
+        :param index: index of the directory, to which the scan is added
+        """
+        self.path = path
+        self.meta_data = meta_data
+        self.index_name = index_name
+        self.columns = list(columns)
+        self.dtype = np.dtype([('position', '<f8'),
+                               *zip(self.columns, dtypes or ['<u4'] * len(self.columns))])
+        self.index = index
+
+        self.points = 0
+        self._file = None
+        self._record = np.zeros(1, dtype=self.dtype)
+
+    def _open(self):
+        header = json.dumps({'meta': self.meta_data,
+                             'index_name': self.index_name,
+                             'dtype': [[name, self.dtype[name].str] for name in self.dtype.names]}).encode()
+        header += b' ' * (-(self.PREFIX.size + len(header)) % 8)   # records are aligned to 8 bytes
+
+        self._file = open(self.path, 'wb')
+        self._file.write(self.PREFIX.pack(self.MAGIC, self.VERSION, 0, len(header)))
+        self._file.write(header)
+        self._file.flush()
+
+        if self.index is not None:
+            self.index.add(self.path, self.meta_data)
+
+    def write_point(self, position: float, values):
+        """
+        Append one record to the archive.
+
+        :param position: position of the motor
+        :param values: values of the columns
+        :return: None
+        """
+        if self._file is None:
+            self._open()
+
+        self._record['position'] = position
+        for name, value in zip(self.columns, values):
+            self._record[name] = value
+        self._file.write(self._record.tobytes())
+        self._file.flush()
+        self.points += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        if self.index is not None:
+            self.index.update(self.path, points=self.points)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, points={self.points})'
+
+
+class ArchiveScan:
+    """
+    Scan read from the binary archive. Opening reads only the prefix and the header, the columns are memory-mapped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+        with open(path, 'rb') as file:
+            magic, version, _, header_length = ArchiveWriter.PREFIX.unpack(file.read(ArchiveWriter.PREFIX.size))
+            if magic != ArchiveWriter.MAGIC:
+                raise ValueError(f'{path} is not a scan archive.')
+            header = json.loads(file.read(header_length))
+
+        self.version = version
+        self.meta = header['meta']
+        self.index_name = header['index_name']
+        self.dtype = np.dtype([tuple(field) for field in header['dtype']])
+
+        offset = ArchiveWriter.PREFIX.size + header_length
+        points = (os.path.getsize(path) - offset) // self.dtype.itemsize
+        if points > 0:
+            self.records = np.memmap(path, dtype=self.dtype, mode='r', offset=offset, shape=(points,))
+        else:
+            self.records = np.empty(0, dtype=self.dtype)
+
+    @property
+    def columns(self) -> list:
+        return list(self.dtype.names[1:])
+
+    @property
+    def positions(self) -> np.ndarray:
+        return self.records['position']
+
+    def __getitem__(self, column: str) -> np.ndarray:
+        return self.records[column]
+
+    def __len__(self):
+        return len(self.records)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        return pd.DataFrame({column: self.records[column] for column in self.columns},
+                            index=pd.Index(self.positions, name=self.index_name))
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, points={len(self)})'
+
+
+class ArchiveIndex:
+    """
+    Index of the scans in the archive directory by type, number, motor and date. It is kept in the `index.json` file
+    of the directory and is rewritten atomically on every change.
+    """
+    FILE_NAME = 'index.json'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILE_NAME)
+
+        if os.path.exists(self.path):
+            with open(self.path) as file:
+                self.scans = json.load(file)
+        else:
+            self.scans = {}
+
+    def add(self, path: str, meta_data: dict):
+        """
+        Add the scan to the index.
+
+        :param path: path to the archive file
+        :param meta_data: metadata of the scan, keys 'scan_type', 'number', 'motor' and 'date' are indexed
+        :return: None
+        """
+        self.scans[os.path.basename(path)] = self._entry(meta_data)
+        self.save()
+
+    def update(self, path: str, **fields):
+        self.scans[os.path.basename(path)].update(fields)
+        self.save()
+
+    def find(self, scan_type: str = None, number: int = None, motor: int = None, date: str = None) -> list:
+        """
+        Find scans by the given fields. The date is matched by prefix, e.g. '2023-05'.
+
+        :return: list of paths to the archive files
+        """
+        found = []
+        for name, entry in sorted(self.scans.items()):
+            if scan_type is not None and entry['scan_type'] != scan_type:
+                continue
+            if number is not None and entry['number'] != number:
+                continue
+            if motor is not None and entry['motor'] != motor:
+                continue
+            if date is not None and not (entry['date'] or '').startswith(date):
+                continue
+            found.append(os.path.join(self.directory, name))
+        return found
+
+    def rebuild(self):
+        """
+        Rebuild the index from the headers of the archive files in the directory.
+
+        :return: None
+        """
+        self.scans = {}
+        for name in os.listdir(self.directory):
+            if name.endswith(ArchiveWriter.EXTENSION):
+                scan = ArchiveScan(os.path.join(self.directory, name))
+                self.scans[name] = self._entry(scan.meta, len(scan))
+        self.save()
+
+    @staticmethod
+    def _entry(meta_data: dict, points: int = 0) -> dict:
+        return {
+            'scan_type': meta_data.get('scan_type'),
+            'number': meta_data.get('number'),
+            'motor': meta_data.get('motor'),
+            'date': meta_data.get('date'),
+            'points': points,
+        }
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(self.scans, file, indent=1)
+        os.replace(temp_path, self.path)
+
+    def __len__(self):
+        return len(self.scans)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.directory!r}, scans={len(self)})'
+
+
+def archive_meta(meta_data: dict, number: int, motor: int) -> dict:
+    """
+    Complete metadata of the scan with the fields indexed in the archive.
+
+    :param meta_data: metadata written to the text data file
+    :param number: number of the data file
+    :param motor: motor of the scan
+    :return: new dict
+    """
+    return {**meta_data, 'number': number, 'motor': motor, 'date': datetime.now().isoformat(timespec='seconds')}
+
@@ -0,0 +1,184 @@
+import asyncio
+import time
+from itertools import count
+from typing import Union
+
+import numpy as np
+
+from .convertor import *
+from .planner import ScanPlan
+from .rsm500.async_controller import AsyncMotor, AsyncDetector
+from .rsm500.interruption import CANCEL
+from .scans import Scan
+
+
+class AsyncScan(Scan):
+    """
+    Scans running in an asyncio event loop. The motors and the detectors are waited for with the coroutines of
+    AsyncMotor and AsyncDetector, so every request to the controller is a separate job of the worker that owns the
+    serial port: other coroutines can use the controller between the requests of the scan (e.g. read a position), and
+    the measured point is recorded, saved and plotted in a thread while the motor moves to the next one. The scans are
+    prepared and finished by the same methods as the synchronous ones of Scan.
+    """
+
+    def __init__(self, settings: Settings):
+        super().__init__(settings)
+
+        self.async_motor = AsyncMotor(self.motor)
+        self.async_detector = AsyncDetector(self.detectors.primary)
+
+    async def motor_scan(self,
+                         scan_type: str,
+                         motor_id: int,
+                         start_val: float,  # it is assumed that the motor is already in this position
+                         steps_num: int,
+                         step_val: float,
+                         exposure: float,
+                         motor2_id: int = None,
+                         plan: ScanPlan = None,
+                         rel_error: float = None):
+        """
+        Step scan (see Scan.motor_scan) without blocking the event loop.
+
+        :return: True if the scan was stopped
+        """
+        plan, writers, pipe, plot_process = await self.async_motor.call(
+            self.start_motor_scan, scan_type, motor_id, start_val, steps_num, step_val, exposure, motor2_id, plan,
+            rel_error)
+        was_stopped = await self.async_execute_plan(plan, exposure, pipe, writers, rel_error)
+        await self.async_motor.call(self.finish_motor_scan, writers, plot_process)
+
+        return was_stopped
+
+    async def async_execute_plan(self, plan: ScanPlan, exposure: float, pipe, writers: list,
+                                 rel_error: float = None) -> bool:
+        """
+        Move the motors through the points of the plan, measure and record each point (see Scan.execute_plan).
+
+        :return: True if the scan was stopped
+        """
+        loop = asyncio.get_running_loop()
+        recording = None
+
+        was_stopped = not await self.async_run_moves(plan.approach)
+        for step_num in range(len(plan) if not was_stopped else 0):
+            if CANCEL.cancelled:
+                was_stopped = True
+                break
+            self.timeline.point = step_num
+            if rel_error is None:
+                data, live_time = await self.async_measurement(exposure), None
+            else:
+                data, live_time = await self.async_adaptive_measurement(exposure, rel_error) or (None, None)
+
+            # if the measurement was interrupted - stop scan
+            if data is None:
+                was_stopped = True
+                break
+
+            if recording is not None:
+                await recording     # the previous point is recorded during the move, re-raise its errors if any
+            recording = loop.run_in_executor(None, self.record_point, plan.positions[step_num], data, pipe, writers,
+                                             live_time)
+
+            # exclude motor move from last step
+            if step_num == len(plan) - 1:
+                break
+
+            self.timeline.point = step_num + 1     # the move belongs to the point, to which the motors move
+            if not await self.async_run_moves(plan.moves[step_num]):
+                was_stopped = True
+                break
+
+        if recording is not None:
+            await recording
+
+        return was_stopped
+
+    async def async_run_moves(self, moves: list) -> bool:
+        """
+        Execute the moves of a plan one after another and update the absolute positions of the motors
+        (see Scan.run_moves).
+
+        :param moves: list of moves (motor, direction, steps)
+        :return: If interrupted - False, else True
+        """
+        for motor, direction, steps in moves:
+            start = time.monotonic()
+            bucket_pos_before_moving = await self.async_motor.select_and_move(motor, direction, steps)
+            expected_end = self.motor.expected_end(self.motor._move)
+            is_moved = await self.async_motor.is_moving()
+            self.add_move_phases(start, expected_end)
+
+            # if the motor moving was interrupted - stop scan
+            if not is_moved:
+                if motor != MOTOR_0:
+                    delta = await self.async_motor.get_position() - bucket_pos_before_moving
+                    self.settings.set_abs_motor_position(motor, delta)
+                return False
+
+            if motor != MOTOR_0:
+                self.settings.set_abs_motor_position(
+                    motor, steps if direction == DIRECTION['positive'][motor] else -steps)
+        return True
+
+    async def async_measurement(self, exposure: Union[int, float]):
+        with self.timeline.phase('counting'):
+            await self.async_detector.start_exposure(int(exposure * 10))
+            is_counted = await self.async_detector.is_counting()
+        if is_counted:  # if the measurement was not interrupted, return the data obtained
+            with self.timeline.phase('readout'):
+                return np.array(await self.async_detector.read_counts(*self.detectors.detectors[1:]), dtype=np.int64)
+        return None
+
+    async def async_adaptive_measurement(self, max_exposure: float, rel_error: float):
+        """
+        Count in slices until the relative uncertainty of the first detector reaches `rel_error`
+        (see Scan.adaptive_measurement).
+
+        :return: counts of the detectors and the live time in seconds, or None if the measurement was interrupted
+        """
+        target = 1 / rel_error ** 2
+        limit = int(round(max_exposure * 10))   # in tenths of a second, as the exposure of the controller
+        counts, live = np.zeros(len(self.detectors), dtype=np.int64), 0
+
+        while live < limit:
+            exposure = self.next_slice(counts[0], live, target, limit)
+
+            with self.timeline.phase('counting'):
+                await self.async_detector.start_exposure(exposure)
+                is_counted = await self.async_detector.is_counting()
+            if not is_counted:
+                return None
+            with self.timeline.phase('readout'):
+                counts = counts + await self.async_detector.read_counts(*self.detectors.detectors[1:])
+            live += exposure
+
+            if counts[0] >= target:
+                break
+
+        return counts, live / 10
+
+    async def manual_scan(self, exposure: float, time_steps_on_plot: int, points: int = 0):
+        """
+        Manual scan (see Scan.manual_scan) without blocking the event loop.
+
+        :return: None
+        """
+        plot_process = self.start_manual_scan(time_steps_on_plot)
+        try:
+            elapsed_time = 0
+            for _ in count() if not points else range(points):     # endless loop if number of points is not set
+                if CANCEL.cancelled:
+                    break
+                data = await self.async_measurement(exposure)
+
+                if data is None:
+                    break
+
+                self.results.append((elapsed_time, *(data / exposure)))    # counts per second
+                elapsed_time += exposure
+        finally:
+            self.finish_manual_scan(plot_process)
+
+        await self.async_motor.call(self.initial_state)
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import re
+from datetime import datetime
+from inspect import signature
+
+import numpy as np
+
+from .config import *
+from .convertor import to_motor_steps
+from .error_types import *
+from .handlers import convert_datatypes_to_func, validate_motor, validate_exposure, validate_budget, \
+    validate_relative_error
+from .planner import ScanPlan
+from .rsm500.interruption import CANCEL
+
+
+class ScanQueue:
+    """
+    Queue of CommandRunner modes loaded from a script and executed one after another without prompts.
+
+    The script has one command per line in the same form as in the command prompt ('mode param_1 param_2 ...'),
+    empty lines and lines starting with '#' are skipped. The whole script is validated before the first entry runs:
+    the modes and the arguments, the motors and the exposures, and the targets of all the moves and scans against the
+    limits of the motors, following the absolute positions from entry to entry.
+
+    The state of the queue is written to '<script>.state.json' after each entry, so an interrupted queue continues
+    from the next entry when it is started again. If an entry is stopped by the interruption key, the operator is
+    asked to repeat it, skip it or pause the queue.
+    """
+    STATE_SUFFIX = '.state.json'
+
+    # modes, that move a motor by (motor, start position, number of steps, step, ...) in the units of the motor
+    MOTOR_SCANS = ['ascan', 'sascan', 'rascan']
+
+    def __init__(self, runner, path: str, prompt=input):
+        """
+
+        :param runner: CommandRunner, which executes the entries
+        :param path: path to the script
+        :param prompt: function, that asks the operator after an interrupted entry
+        """
+        self.runner = runner
+        self.path = path
+        self.prompt = prompt
+        self.state_path = path + self.STATE_SUFFIX
+
+        with open(path) as file:
+            text = file.read()
+        self.digest = hashlib.sha1(text.encode()).hexdigest()
+
+        self.entries = []   # (line number, mode, list of arguments)
+        for line_num, line in enumerate(text.splitlines(), start=1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                mode, *args = re.sub(r'\s+', ' ', line).split(' ')
+                self.entries.append((line_num, mode, args))
+
+        self.next = 0
+        self.history = []
+        self._load_state()
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return
+        with open(self.state_path) as file:
+            state = json.load(file)
+        # the state of another version of the script or of the completed queue is ignored
+        if state.get('digest') == self.digest and state['next'] < len(self.entries):
+            self.next = state['next']
+            self.history = state['history']
+
+    def save_state(self):
+        temp_path = self.state_path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'script': self.path, 'digest': self.digest, 'next': self.next, 'history': self.history},
+                      file, indent=1)
+        os.replace(temp_path, self.state_path)
+
+    def validate(self) -> list:
+        """
+        Check all the remaining entries of the queue.
+
+        :return: list of converted arguments of the entries
+        """
+        positions = {motor: self.runner.settings.get_abs_motor_position(motor) for motor in [MOTOR_1, MOTOR_2, MOTOR_3]}
+        limits = {motor: self.runner.settings.get_limits(motor) for motor in positions}
+
+        entries = []
+        for line_num, mode, args in self.entries[self.next:]:
+            try:
+                if mode not in self.runner.modes or mode == 'queue':
+                    raise KeyError(f'Command {mode} cannot be queued.')
+                command = self.runner.modes[mode]
+                converted = convert_datatypes_to_func(command, *args)
+                if converted is None:
+                    raise ValueError(f'Invalid arguments: {" ".join(args)}.')
+
+                params = dict(zip(signature(command).parameters, converted))
+                # the same checks as in handlers.validate_and_log, so the entry does not fail only when it runs
+                if 'motor' in params:
+                    validate_motor(params['motor'], mode)
+                if 'step_num' in params and not params['step_num'] > 0:
+                    raise ValueError('Number of steps cannot be less than 0.')
+                if 'exposure' in params:
+                    validate_exposure(params['exposure'])
+                if 'budget' in params:
+                    validate_budget(params['budget'])
+                if 'rel_error' in params:
+                    validate_relative_error(params['rel_error'])
+                self._follow_positions(mode, converted, positions, limits)
+            except (KeyError, ValueError, TypeError, MotorException, DetectorException) as message:
+                raise ValueError(f'{self.path}, line {line_num} [{mode}]: {message}')
+            entries.append(converted)
+        return entries
+
+    @classmethod
+    def _follow_positions(cls, mode: str, args: list, positions: dict, limits: dict):
+        """
+        Check the targets of the entry against the limits and update the expected absolute positions.
+
+        :param mode: name of the mode
+        :param args: converted arguments
+        :param positions: dict {motor_id: absolute position in steps}, it is updated
+        :param limits: dict {motor_id: (lower limit, upper limit)}
+        :return: None
+        """
+        if mode in ['move', 'amove']:
+            motor, value = args
+            if motor == MOTOR_0:
+                return
+            target = to_motor_steps(motor, value) + (positions[motor] if mode == 'move' else 0)
+            plan = ScanPlan([motor], np.array([value]), np.array([[target]]))
+        elif mode in cls.MOTOR_SCANS or mode == 'fascan':
+            motor, start, steps_num, step = args[:4]
+            plan = ScanPlan.build(motor, start, steps_num, step) if mode != 'fascan' \
+                else ScanPlan.build(motor, start, 2, steps_num * step)
+        elif mode == 'a2scan':
+            start, steps_num, step = args[:3]
+            plan = ScanPlan.build(MOTOR_1, start, steps_num, step, MOTOR_2)
+        elif mode == 'setAPos':
+            positions[args[0]] = 0
+            return
+        else:
+            return
+
+        plan.validate(limits)
+        for column, motor in enumerate(plan.motor_ids):
+            positions[motor] = int(plan.targets[-1][column])
+
+    def run(self) -> bool:
+        """
+        Validate the queue and execute its remaining entries.
+
+        :return: True if the queue was paused
+        """
+        entries = self.validate()
+        log = self.runner.log
+        log.info(f'Queue {self.path}: {len(entries)} entries to run, starting from the entry {self.next + 1}.')
+
+        for (line_num, mode, args), converted in zip(self.entries[self.next:], entries):
+            while True:
+                CANCEL.clear()  # the interruption of the previous entry does not stop this one
+                started = datetime.now().isoformat(timespec='seconds')
+                log.info(f'Queue entry {self.next + 1}/{len(self.entries)} (line {line_num}): {mode} {" ".join(args)}')
+                try:
+                    # move, amove and mscan do not return the status, so the cancellation is checked too
+                    was_stopped = self.runner.modes[mode](*converted) or CANCEL.cancelled
+                    status = 'stopped' if was_stopped else 'completed'
+                except Exception as message:    # the queue goes on with the next entry
+                    log.error(f'Queue entry {self.next + 1} failed: {message!r}')
+                    was_stopped, status = False, 'failed'
+
+                action = self.ask() if was_stopped else 'next'
+                if action != 'repeat':
+                    break
+
+            self.history.append({'line': line_num, 'command': ' '.join([mode, *args]), 'status': status,
+                                 'started': started, 'finished': datetime.now().isoformat(timespec='seconds')})
+            if action == 'pause':
+                self.save_state()
+                log.info(f'Queue {self.path} is paused before the entry {self.next + 1}.')
+                return True
+
+            self.next += 1
+            self.save_state()
+
+        log.info(f'Queue {self.path} is completed.')
+        return False
+
+    def ask(self) -> str:
+        """
+        Ask the operator, what to do with the interrupted entry. Without the input (stdin is closed or redirected, e.g.
+        an unattended run) the queue is paused, so it can be continued later.
+
+        :return: 'repeat', 'next' or 'pause'
+        """
+        actions = {'r': 'repeat', 's': 'next', 'p': 'pause'}
+        while True:
+            try:
+                answer = self.prompt('Entry was interrupted: [r]epeat, [s]kip or [p]ause the queue? ').strip().lower()
+            except EOFError:
+                self.runner.log.warning(f'Queue {self.path}: no input to answer, the queue is paused.')
+                return 'pause'
+            if answer[:1] in actions:
+                return actions[answer[:1]]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, next={self.next}/{len(self)})'
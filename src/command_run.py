@@ -1,7 +1,11 @@
+import atexit
+
+from .batch import ScanQueue
 from .convertor import to_motor_steps, to_step_units
 from .handlers import *
 from .logger import LogHandler
-from .rsm500 import Motor, Detector
+from .planner import ScanPlan
+from .rsm500 import Motor, METRICS, MetricsExporter, CANCEL, InterruptListener
 from .scans import Scan
 
 
@@ -12,18 +16,36 @@ class CommandRunner:
         self.log = self.__lh.logger
 
         self.motor = Motor()
-        self.detector_1 = Detector(COUNTER[1])
-        self.detector_2 = Detector(COUNTER[2])
-
         # self.rsm = rsm
         self.settings = settings
+
+        # transactions with the controller are measured only if it is switched on in the settings
+        METRICS.enabled = settings.metrics_enabled
+        self.metrics_exporter = None
+        if settings.metrics_enabled and settings.metrics_textfile:
+            self.metrics_exporter = MetricsExporter(METRICS, settings.metrics_textfile,
+                                                    settings.metrics_interval).start()
+            atexit.register(self.metrics_exporter.stop)
         self.scan = Scan(self.settings)
+        self.detectors = self.scan.detectors
+
+        # the running command is cancelled by the hot key, SIGINT or the control socket
+        self.interrupts = InterruptListener(CANCEL, settings.interruption_key, settings.interrupt_on_sigint,
+                                            settings.control_port).start()
+        atexit.register(self.interrupts.stop)
 
         self.modes = {
             self.escan.__name__: self.escan,
             self.ascan.__name__: self.ascan,
             self.a2scan.__name__: self.a2scan,
+            self.rescan.__name__: self.rescan,
+            self.rascan.__name__: self.rascan,
+            self.sescan.__name__: self.sescan,
+            self.sascan.__name__: self.sascan,
+            self.fescan.__name__: self.fescan,
+            self.fascan.__name__: self.fascan,
             self.mscan.__name__: self.mscan,
+            self.queue.__name__: self.queue,
             self.move.__name__: self.move,
             self.amove.__name__: self.amove,
             self.setV.__name__: self.setV,
@@ -33,6 +55,7 @@ class CommandRunner:
             self.getV.__name__: self.getV,
             self.getT.__name__: self.getT,
             self.getAPos.__name__: self.getAPos,
+            self.getM.__name__: self.getM,
             **dict.fromkeys(['info', 'help'], self.info)
         }
 
@@ -47,6 +70,36 @@ class CommandRunner:
                                   'Input number of steps: ',
                                   'Input value of each step: ',
                                   'input exposure in seconds: '],
+            self.rescan.__name__: ['Input start rev of the reel: ',
+                                   'Input number of coarse steps: ',
+                                   'Input coarse step value in rev of the reel: ',
+                                   'Input exposure in seconds: ',
+                                   'Input number of additional points: '],
+            self.rascan.__name__: ['Input motor number: ',
+                                   'Input start position: ',
+                                   'Input number of coarse steps: ',
+                                   'Input value of each coarse step: ',
+                                   'Input exposure in seconds: ',
+                                   'Input number of additional points: '],
+            self.sescan.__name__: ['Input start rev of the reel: ',
+                                   'Input number of steps: ',
+                                   'Input step value in rev of the reel: ',
+                                   'Input maximal exposure in seconds: ',
+                                   'Input relative error of the counts: '],
+            self.sascan.__name__: ['Input motor number: ',
+                                   'Input start position: ',
+                                   'Input number of steps: ',
+                                   'Input value of each step: ',
+                                   'Input maximal exposure in seconds: ',
+                                   'Input relative error of the counts: '],
+            self.fescan.__name__: ['Input start rev of the reel: ',
+                                   'Input number of intervals: ',
+                                   'Input interval in rev of the reel: '],
+            self.fascan.__name__: ['Input motor number: ',
+                                   'Input start position: ',
+                                   'Input number of intervals: ',
+                                   'Input width of each interval: '],
+            self.queue.__name__: ['Input path to the script: '],
             self.move.__name__: ['Input motor number: ', 'Input step: '],
             self.amove.__name__: ['Input motor number: ', 'Input position to move: '],
             self.setV.__name__: [f'Input voltage for the photocathode of the detector {i + 1}: ' for i
@@ -60,7 +113,8 @@ class CommandRunner:
                 self.mscan.__name__,
                 self.getV.__name__,
                 self.getT.__name__,
-                self.getAPos.__name__
+                self.getAPos.__name__,
+                self.getM.__name__
             ], [])
         }
 
@@ -101,7 +155,8 @@ class CommandRunner:
                 for phrase, param_type in zip(self.input_phrases[mode], command.__annotations__.values()):
                     _args.append(param_type(input(phrase)))
 
-            command(*_args)
+            with CANCEL.scope():
+                return command(*_args)
 
         except KeyError as message:
             print(f'Invalid key value:', message)
@@ -128,7 +183,8 @@ class CommandRunner:
         :return: None
         """
         step, = validate_values(MOTOR_0, [step], self.log)
-        self.scan.motor_scan('escan', MOTOR_0, start, step_num, step, exposure)
+        plan = self.plan_scan(MOTOR_0, start, step_num, step, exposure)
+        return self.scan.motor_scan('escan', MOTOR_0, start, step_num, step, exposure, plan=plan)
 
     @validate_and_log
     def ascan(self, motor: int, start_position: float, step_num: int, step: float, exposure: float):
@@ -143,8 +199,9 @@ class CommandRunner:
         :return: None
         """
         start_position, step = validate_values(motor, [start_position, step], self.log)
+        plan = self.plan_scan(motor, start_position, step_num, step, exposure)
         self.amove(motor, start_position)  # move to start position
-        self.scan.motor_scan('ascan', motor, start_position, step_num, step, exposure)
+        return self.scan.motor_scan('ascan', motor, start_position, step_num, step, exposure, plan=plan)
 
     @validate_and_log
     def a2scan(self, start_position: float, step_num: int, step: float, exposure: float):
@@ -159,16 +216,152 @@ class CommandRunner:
         """
         # move motors to start positions
         start_position, step = validate_values(MOTOR_1, [start_position, step], self.log)
+        plan = self.plan_scan(MOTOR_1, start_position, step_num, step, exposure, motor2_id=MOTOR_2)
         self.amove(MOTOR_1, start_position)
         self.amove(MOTOR_2, 2 * start_position)
-        self.scan.motor_scan('a2scan', MOTOR_1, start_position, step_num, step, exposure, motor2_id=MOTOR_2)
+        return self.scan.motor_scan('a2scan', MOTOR_1, start_position, step_num, step, exposure, motor2_id=MOTOR_2,
+                                    plan=plan)
+
+    @validate_and_log
+    def rescan(self, start: float, step_num: int, step: float, exposure: float, budget: int, tolerance: float = 3.):
+        """
+        Run an energy scan with the refinement: after a coarse pass, points are added in the middle of the intervals
+        with a significant change of the counts, until `budget` points are added or no interval exceeds `tolerance`.
+
+        :param start: value in revs of the reel from which the scan starts
+        :param step_num: number of coarse steps
+        :param step: value of one coarse step in revs of the reel
+        :param exposure: exposure time of the detectors
+        :param budget: largest number of additional points
+        :param tolerance: significance of the change of the counts in Poisson standard deviations, that is refined
+        :return: None
+        """
+        validate_budget(budget)
+        step, = validate_values(MOTOR_0, [step], self.log)
+        plan = self.plan_scan(MOTOR_0, start, step_num, step, exposure)
+        return self.scan.refinement_scan('escan', MOTOR_0, start, step_num, step, exposure, budget, tolerance,
+                                         plan=plan)
+
+    @validate_and_log
+    def rascan(self, motor: int, start_position: float, step_num: int, step: float, exposure: float, budget: int,
+               tolerance: float = 3.):
+        """
+        Run scanning by the given motor from the specified absolute position with the refinement around features.
+
+        :param motor: number of the motor
+        :param start_position: specifies position, to which motor will move before scanning
+        :param step_num: number of coarse steps
+        :param step: value of each coarse step
+        :param exposure: time exposure of the detectors
+        :param budget: largest number of additional points
+        :param tolerance: significance of the change of the counts in Poisson standard deviations, that is refined
+        :return: None
+        """
+        validate_budget(budget)
+        start_position, step = validate_values(motor, [start_position, step], self.log)
+        plan = self.plan_scan(motor, start_position, step_num, step, exposure)
+        self.amove(motor, start_position)  # move to start position
+        return self.scan.refinement_scan('ascan', motor, start_position, step_num, step, exposure, budget, tolerance,
+                                         plan=plan)
+
+    @validate_and_log
+    def sescan(self, start: float, step_num: int, step: float, exposure: float, rel_error: float):
+        """
+        Run an energy scan with the adaptive exposure: each point is counted until the relative uncertainty of the
+        counts of the first detector reaches `rel_error`, but no longer than `exposure`.
+
+        :param start: value in revs of the reel from which the scan starts
+        :param step_num: number of steps
+        :param step: value of one step in revs of the reel
+        :param exposure: maximal exposure time of the detectors for one point
+        :param rel_error: target relative uncertainty of the counts, e.g. 0.01
+        :return: None
+        """
+        validate_relative_error(rel_error)
+        step, = validate_values(MOTOR_0, [step], self.log)
+        plan = self.plan_scan(MOTOR_0, start, step_num, step, exposure)
+        return self.scan.motor_scan('escan', MOTOR_0, start, step_num, step, exposure, plan=plan, rel_error=rel_error)
+
+    @validate_and_log
+    def sascan(self, motor: int, start_position: float, step_num: int, step: float, exposure: float,
+               rel_error: float):
+        """
+        Run scanning by the given motor from the specified absolute position with the adaptive exposure.
+
+        :param motor: number of the motor
+        :param start_position: specifies position, to which motor will move before scanning
+        :param step_num: number of steps
+        :param step: value of each step
+        :param exposure: maximal exposure time of the detectors for one point
+        :param rel_error: target relative uncertainty of the counts, e.g. 0.01
+        :return: None
+        """
+        validate_relative_error(rel_error)
+        start_position, step = validate_values(motor, [start_position, step], self.log)
+        plan = self.plan_scan(motor, start_position, step_num, step, exposure)
+        self.amove(motor, start_position)  # move to start position
+        return self.scan.motor_scan('ascan', motor, start_position, step_num, step, exposure, plan=plan,
+                                    rel_error=rel_error)
+
+    @validate_and_log
+    def fescan(self, start: float, step_num: int, step: float):
+        """
+        Run an energy fly scan: the reel rotates continuously and the counts are binned into intervals.
+
+        :param start: value in revs of the reel from which the scan starts
+        :param step_num: number of intervals
+        :param step: width of one interval in revs of the reel
+        :return: None
+        """
+        step, = validate_values(MOTOR_0, [step], self.log)
+        plan = self.plan_scan(MOTOR_0, start, 2, step_num * step, 0.)
+        return self.scan.fly_scan('escan', MOTOR_0, start, step_num, step, plan=plan)
+
+    @validate_and_log
+    def fascan(self, motor: int, start_position: float, step_num: int, step: float):
+        """
+        Run a fly scan by the given motor from the specified absolute position: the motor moves continuously and the
+        counts are binned into intervals.
+
+        :param motor: number of the motor
+        :param start_position: specifies position, to which motor will move before scanning
+        :param step_num: number of intervals
+        :param step: width of each interval
+        :return: None
+        """
+        start_position, step = validate_values(motor, [start_position, step], self.log)
+        plan = self.plan_scan(motor, start_position, 2, step_num * step, 0.)
+        self.amove(motor, start_position)  # move to start position
+        return self.scan.fly_scan('ascan', motor, start_position, step_num, step, plan=plan)
+
+    def plan_scan(self, motor: int, start_position: float, step_num: int, step: float, exposure: float,
+                  motor2_id: int = None) -> ScanPlan:
+        """
+        Compute the targets of the scan and check them against the limits of the motors before any motor moves.
 
-    def mscan(self, exposure: float = 1., time_steps_on_plot: int = 30):
+        :param motor: number of the motor, which determines the positions
+        :param start_position: position of the first point
+        :param step_num: number of steps
+        :param step: value of each step
+        :param exposure: time exposure of the detectors
+        :param motor2_id: second motor moving with the twice greater step
+        :return: ScanPlan
+        """
+        plan = ScanPlan.build(motor, start_position, step_num, step, motor2_id)
+        motors = [motor_id for motor_id in plan.motor_ids if motor_id != MOTOR_0]   # the reel has no limits
+        plan.validate({motor_id: self.settings.get_limits(motor_id) for motor_id in motors})
+
+        current = {motor_id: self.settings.get_abs_motor_position(motor_id) for motor_id in motors}
+        self.log.info(f'Planned {len(plan)} points, estimated duration: {plan.duration(exposure, current):.1f} s')
+        return plan
+
+    def mscan(self, exposure: float = 1., time_steps_on_plot: int = 30, points: int = 0):
         """
         Continuously displays CPS values on a plot over time.
 
         :param exposure: exposure time of the detectors
         :param time_steps_on_plot: number of time steps on a plot
+        :param points: number of measurements, 0 - until interrupted
         :return: None
         """
 
@@ -176,7 +369,18 @@ class CommandRunner:
         if not time_steps_on_plot > 1:
             raise PlotException('Number of steps on a plot cannot be less than 1.')
 
-        self.scan.manual_scan(exposure, time_steps_on_plot)
+        self.scan.manual_scan(exposure, time_steps_on_plot, points)
+
+    def queue(self, path: str):
+        """
+        Run the commands from the script one after another. The script has one command per line in the form
+        'mode param_1 param_2 ...', lines starting with '#' are comments. The whole script is validated before the
+        start; the progress is saved after each command, and the queue started again continues from the next one.
+
+        :param path: path to the script
+        :return: True if the queue was paused
+        """
+        return ScanQueue(self, path).run()
 
     def move(self, motor_id: int, step: float):
         # TODO: complete the doc after determination of dependence of motor steps on distance for motor_3
@@ -272,11 +476,13 @@ class CommandRunner:
         for voltage in [detector_1_v, detector_2_v]:
             validate_photocathode_voltage(voltage)
 
-        self.detector_1.set_voltage_on_photocathode(detector_1_v)
-        self.detector_2.set_voltage_on_photocathode(detector_2_v)
+        names = self.detectors.names[:2]
+        for name, voltage in zip(names, [detector_1_v, detector_2_v]):
+            self.detectors.set_voltage(name, voltage)
 
-        self.log.info(f'Voltage on the photocathodes: {self.detector_1.get_voltage_on_photocathode()}V (1), '
-                      f'{self.detector_2.get_voltage_on_photocathode()}V (2)')
+        self.detectors.refresh()    # read back the voltages
+        self.log.info('Voltage on the photocathodes: ' +
+                      ', '.join(f'{self.detectors.voltage(name)}V ({i})' for i, name in enumerate(names, start=1)))
 
     def getV(self):
         """
@@ -284,43 +490,44 @@ class CommandRunner:
 
         :return: None
         """
-        print(f'Voltage on the photocathodes: {self.detector_1.get_voltage_on_photocathode()}V (1), '
-              f'{self.detector_2.get_voltage_on_photocathode()}V (2)')
+        self.detectors.refresh()
+        names = self.detectors.names
+        print('Voltage on the photocathodes: ' +
+              ', '.join(f'{self.detectors.voltage(name)}V ({i})' for i, name in enumerate(names, start=1)))
 
     def setT(self, detector_num: int, low_threshold: int, up_threshold: int):
         """
         Set lower and upper thresholds for the given detector.
 
-        :param detector_num: number of the detector (1 or 2)
+        :param detector_num: number of the detector (from 1, in the order of the channels in the settings)
         :param low_threshold: lower threshold in mV
         :param up_threshold: upper threshold in mV
         :return: None
         """
 
-        if detector_num not in COUNTER:
+        if not 1 <= detector_num <= len(self.detectors):
             raise DetectorException('invalid number of the detector.')
         if not 0 <= low_threshold < 4096 or not 0 <= up_threshold < 4096:
             raise DetectorException('Thresholds must be in the range [0, 4096).')
         if not low_threshold < up_threshold:
             raise DetectorException('The lower threshold cannot be greater than or equal to the upper one.')
 
-        detector = self.detector_1 if detector_num == 1 else self.detector_2
-
-        for id_level, value in zip([LOWER_THRESHOLD, UPPER_THRESHOLD], [low_threshold, up_threshold]):
-            detector.set_threshold(id_level, value)
+        name = self.detectors.names[detector_num - 1]
+        self.detectors.set_thresholds(name, low_threshold, up_threshold)
 
-        self.log.info(f'Detector {detector_num} thresholds: {detector.get_threshold(LOWER_THRESHOLD)} mV,'
-                      f' {detector.get_threshold(UPPER_THRESHOLD)} mV')
+        self.detectors.refresh()    # read back the thresholds
+        low_threshold, up_threshold = self.detectors.thresholds(name)
+        self.log.info(f'Detector {detector_num} thresholds: {low_threshold} mV, {up_threshold} mV')
 
     def set2T(self, low_threshold: int, up_threshold: int):
         """
-        Set the same thresholds for the both detectors.
+        Set the same thresholds for all the detectors.
 
         :param low_threshold: lower threshold in mV
         :param up_threshold: upper threshold in mV
         :return: None
         """
-        for detector_num in COUNTER:
+        for detector_num in range(1, len(self.detectors) + 1):
             self.setT(detector_num, low_threshold, up_threshold)
 
     def getT(self):
@@ -329,9 +536,10 @@ class CommandRunner:
 
         :return: None
         """
-        for i, detector in enumerate([self.detector_1, self.detector_2]):
-            print(f'Thresholds for the detector {i}: {detector.get_threshold(LOWER_THRESHOLD)} mV, '
-                  f'{detector.get_threshold(UPPER_THRESHOLD)} mV')
+        self.detectors.refresh()
+        for i, name in enumerate(self.detectors.names, start=1):
+            low_threshold, up_threshold = self.detectors.thresholds(name)
+            print(f'Thresholds for the detector {i}: {low_threshold} mV, {up_threshold} mV')
 
     def setAPos(self, motor_num: int):
         """
@@ -358,6 +566,25 @@ class CommandRunner:
             print(f'Motor {motor_num}:   {apos_in_units:.2f} {self.scan.x_scale[motor_num].split(" ")[1]:<5} '
                   f'({apos_in_motor_steps})')
 
+    def getM(self):
+        """
+        Output the statistics of the transactions with the controller and of the poll loops, if the metrics are
+        switched on in the settings.
+
+        :return: None
+        """
+        if not METRICS.enabled:
+            print('Metrics are switched off in the settings.')
+            return
+
+        summary = METRICS.summary()
+        print(f'{"command":<16}{"calls":>8}{"sent":>10}{"received":>10}{"p50, ms":>10}{"p99, ms":>10}')
+        for op_code, stats in summary['opcodes'].items():
+            print(f'{op_code:<16}{stats["calls"]:>8}{stats["bytes_sent"]:>10}{stats["bytes_received"]:>10}'
+                  f'{stats["p50"] * 1000:>10.2f}{stats["p99"] * 1000:>10.2f}')
+        for loop, polls in summary['polls'].items():
+            print(f'Polls in {loop}: {polls}')
+
     def info(self):
         print('\t==== List of commands with parameters ====')
         for mode, function in self.modes.items():
@@ -12,8 +12,9 @@ MOTOR_0 = 0   # energy scan
 MOTOR_1 = 1   # rotation of the sample holder
 MOTOR_2 = 2   # rotation of the second detector
 MOTOR_3 = 3   # sample holder movement along 'x' axis
+MOTORS = [MOTOR_0, MOTOR_1, MOTOR_2, MOTOR_3]
 
-KEY_FOR_INTERRUPTION = 'ctrl+q'  # TODO: Перенести в settings
+KEY_FOR_INTERRUPTION = 'ctrl+q'  # hot key, if it is not set in settings.ini [INTERRUPTION]
 
 DIRECTION = {
     'negative': {MOTOR_0: 0, MOTOR_1: 0, MOTOR_2: 1, MOTOR_3: 0},
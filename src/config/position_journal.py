@@ -0,0 +1,87 @@
+import os
+import struct
+import zlib
+
+
+class PositionJournal:
+    """
+    Append-only journal of the absolute motor positions. Each update is one fixed-size record
+    (motor: uint8, position: int64, crc32 of both: uint32) appended and forced to the disk, so the positions survive
+    a power cut without rewriting settings.ini. Records hold absolute positions, so replaying the journal over any
+    earlier state of settings.ini gives the last positions. A record torn by a crash fails its checksum; it is cut off
+    together with everything after it, so the next records are appended right after the last valid one.
+    """
+    RECORD = struct.Struct('<BqI')
+    _DATA = struct.Struct('<Bq')
+
+    def __init__(self, path: str):
+        self.path = path
+        self.records = 0    # number of records since the last clearing
+        self._file = None
+
+    def replay(self) -> dict:
+        """
+        Read the valid records of the journal and truncate the journal after the last of them.
+
+        :return: dict {motor_num: last absolute position}
+        """
+        positions = {}
+        if not os.path.exists(self.path):
+            return positions
+
+        with open(self.path, 'rb') as file:
+            data = file.read()
+
+        self.records = 0
+        for offset in range(0, len(data) - self.RECORD.size + 1, self.RECORD.size):
+            motor_num, position, crc = self.RECORD.unpack_from(data, offset)
+            if crc != zlib.crc32(data[offset:offset + self._DATA.size]):
+                break
+            positions[motor_num] = position
+            self.records += 1
+
+        valid_size = self.records * self.RECORD.size
+        if valid_size < len(data):  # a torn record, the records appended after it would be misaligned
+            os.truncate(self.path, valid_size)
+        return positions
+
+    def append(self, motor_num: int, position: int):
+        """
+        Append the absolute position of the motor to the journal and force it to the disk.
+
+        :param motor_num: number of the motor
+        :param position: absolute position in motor steps
+        :return: None
+        """
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+
+        data = self._DATA.pack(motor_num, position)
+        self._file.write(data + struct.pack('<I', zlib.crc32(data)))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.records += 1
+
+    def clear(self):
+        """
+        Truncate the journal after the positions were written to settings.ini.
+
+        :return: None
+        """
+        if self._file is not None:
+            self._file.truncate(0)
+            os.fsync(self._file.fileno())
+        elif os.path.exists(self.path):
+            os.truncate(self.path, 0)
+        self.records = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __len__(self):
+        return self.records
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, records={self.records})'
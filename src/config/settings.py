@@ -1,14 +1,48 @@
+import atexit
 import configparser
 
 from .definitions import *
+from .position_journal import PositionJournal
 
 
 class Settings:
     path_to_settings_ini = os.path.join(ROOT_DIR, SETTINGS_DIR, 'settings.ini')
 
-    def __init__(self):
+    COMPACT_EVERY = 1000    # number of journal records, after which the positions are written to settings.ini
+
+    # sections added after the first versions of settings.ini, the missing keys are taken from here on loading
+    DEFAULTS = {
+        'DATA_FILES': {'fsync_every': '1', 'binary_archive': 'no'},
+        'INTERRUPTION': {'key': KEY_FOR_INTERRUPTION, 'sigint': 'yes', 'control_port': ''},
+        'METRICS': {'enabled': 'no', 'textfile': '', 'interval': '15'},
+        'CALIBRATION': {'motor_0': '75000 1', 'motor_1': '8000 90', 'motor_2': '8000 90', 'motor_3': '1 1'},
+        'MOTOR_SPEED': {'motor_0': '2000', 'motor_1': '400', 'motor_2': '400', 'motor_3': '400'},
+    }
+    # the channels are added only if the section is missing, so the listed ones are not extended
+    DEFAULT_DETECTORS = {f'counter_{detector}': str(channel) for detector, channel in COUNTER.items()}
+
+    def __init__(self, path_to_settings_ini: str = None):
+        if path_to_settings_ini is not None:
+            self.path_to_settings_ini = path_to_settings_ini
         self._config = configparser.ConfigParser()
         self._config.read(self.path_to_settings_ini)
+        self._add_defaults()
+
+        # absolute positions of the motors changed after the last saving of settings.ini (e.g. before a crash)
+        self._journal = PositionJournal(os.path.splitext(self.path_to_settings_ini)[0] + '.journal')
+        for motor_num, position in self._journal.replay().items():
+            self._config['ABSOLUTE_MOTOR_POSITION'][f'motor_{motor_num}'] = str(position)
+        self._journal_registered = False
+
+    def _add_defaults(self):
+        for section, values in self.DEFAULTS.items():
+            if not self._config.has_section(section):
+                self._config.add_section(section)
+            for key, value in values.items():
+                if not self._config.has_option(section, key):
+                    self._config[section][key] = value
+        if not self._config.has_section('DETECTORS'):
+            self._config['DETECTORS'] = self.DEFAULT_DETECTORS
 
     @property
     def port(self):
@@ -37,17 +71,136 @@ class Settings:
         self._config['PATHS']['path_to_datafiles'] = path
         self.save_changes()
 
+    @property
+    def fsync_every(self):
+        return int(self._config['DATA_FILES']['fsync_every'])
+
+    @fsync_every.setter
+    def fsync_every(self, value: int):
+        self._config['DATA_FILES']['fsync_every'] = str(value)
+        self.save_changes()
+
+    @property
+    def binary_archive(self):
+        return self._config.getboolean('DATA_FILES', 'binary_archive')
+
+    @binary_archive.setter
+    def binary_archive(self, value: bool):
+        self._config['DATA_FILES']['binary_archive'] = 'yes' if value else 'no'
+        self.save_changes()
+
+    @property
+    def interruption_key(self):
+        # KEY_FOR_INTERRUPTION if the key is not in settings.ini, no hot key if it is empty
+        return self._config.get('INTERRUPTION', 'key', fallback=KEY_FOR_INTERRUPTION) or None
+
+    @property
+    def interrupt_on_sigint(self):
+        return self._config.getboolean('INTERRUPTION', 'sigint')
+
+    @property
+    def control_port(self):
+        value = self._config['INTERRUPTION']['control_port']
+        return int(value) if value else None
+
+    @property
+    def metrics_enabled(self):
+        return self._config.getboolean('METRICS', 'enabled')
+
+    @metrics_enabled.setter
+    def metrics_enabled(self, value: bool):
+        self._config['METRICS']['enabled'] = 'yes' if value else 'no'
+        self.save_changes()
+
+    @property
+    def metrics_textfile(self):
+        return self._config['METRICS']['textfile']
+
+    @property
+    def metrics_interval(self):
+        return float(self._config['METRICS']['interval'])
+
     def get_abs_motor_position(self, motor_num: int) -> int:
         return int(self._config['ABSOLUTE_MOTOR_POSITION'][f'motor_{motor_num}'])
 
     def set_abs_motor_position(self, motor_num: int, value: int) -> None:
-        self._config['ABSOLUTE_MOTOR_POSITION'][f'motor_{motor_num}'] = \
-            str(int(self._config['ABSOLUTE_MOTOR_POSITION'][f'motor_{motor_num}']) + value)
-        self.save_changes()
+        """
+        Shift the absolute position of the motor by the given value. The new position is appended to the journal,
+        settings.ini is rewritten only every COMPACT_EVERY updates and at the exit of the program.
+
+        :param motor_num: number of the motor
+        :param value: shift in motor steps
+        :return: None
+        """
+        position = self.get_abs_motor_position(motor_num) + value
+        self._config['ABSOLUTE_MOTOR_POSITION'][f'motor_{motor_num}'] = str(position)
+
+        if not self._journal_registered:
+            atexit.register(self.close)
+            self._journal_registered = True
+
+        self._journal.append(motor_num, position)
+        if len(self._journal) >= self.COMPACT_EVERY:
+            self.save_changes()
+
+    def get_motor_speed(self, motor_num: int) -> float:
+        return float(self._config['MOTOR_SPEED'][f'motor_{motor_num}'])
+
+    def get_motor_speeds(self) -> dict:
+        """
+        :return: dict {motor_id: initial speed in steps per second} of all the motors
+        """
+        return {motor: self.get_motor_speed(motor) for motor in MOTORS}
+
+    @property
+    def detectors(self) -> dict:
+        """
+        :return: dict {name of the channel: detector identifier in the controller} in the order of the columns of the
+        data files, the first channel starts the counts
+        """
+        return {name: int(detector_id) for name, detector_id in self._config['DETECTORS'].items()}
+
+    def get_calibration(self, motor_num: int) -> tuple:
+        """
+        :param motor_num: number of the motor
+        :return: number of motor steps and the corresponding distance in the units of the motor
+        """
+        steps, units = self._config['CALIBRATION'][f'motor_{motor_num}'].split(' ')
+        return int(steps), float(units)
+
+    def get_calibrations(self) -> dict:
+        """
+        :return: dict {motor_id: (number of motor steps, distance in the units of the motor)} of all the motors
+        """
+        return {motor: self.get_calibration(motor) for motor in MOTORS}
 
     def get_limits(self, motor_num: int) -> tuple:
         return tuple(map(int, self._config['LIMITS'][f'motor_{motor_num}'].split(' ')))
 
+    def close(self):
+        """
+        Write the journaled positions to settings.ini and close the journal. It is called at the exit of the program,
+        if the positions were changed.
+
+        :return: None
+        """
+        if len(self._journal):
+            self.save_changes()
+        self._journal.close()
+        if self._journal_registered:
+            atexit.unregister(self.close)
+            self._journal_registered = False
+
     def save_changes(self):
-        with open(self.path_to_settings_ini, 'w') as configfile:
-            self._config.write(configfile)
\ No newline at end of file
+        """
+        Write settings.ini atomically and clear the journal of the positions, that are now stored in the file.
+
+        :return: None
+        """
+        temp_path = self.path_to_settings_ini + '.tmp'
+        with open(temp_path, 'w') as configfile:
+            self._config.write(configfile)
+            configfile.flush()
+            os.fsync(configfile.fileno())
+        os.replace(temp_path, self.path_to_settings_ini)
+        self._journal.clear()
\ No newline at end of file
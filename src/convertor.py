@@ -1,54 +1,108 @@
+from typing import Union
+
+import numpy as np
+
 from .config import *
 
 
 """
 MOTOR_0: 75000 motor steps ≡ 1 rev of the reel
-MOTOR_1: 8000 motor steps ≡ 90 degrees,  90 / 8000 = 0.01125  
+MOTOR_1: 8000 motor steps ≡ 90 degrees,  90 / 8000 = 0.01125
 MOTOR_2: the same
-MOTOR_3: 
+MOTOR_3:
 """
 
 
+class MotorCalibration:
+    """
+    Conversion between the units of a motor (rev, degrees, mm) and its steps: `steps` motor steps ≡ `units` units.
+    Both methods accept a number or a NumPy array, so a whole trajectory is converted in one call. Units are
+    converted to steps by rounding to the nearest integer (half to even) for scalars and arrays alike.
+    """
+    # calibrations of the motors, loaded from settings.ini [CALIBRATION] with `set_calibrations` when Scan is created
+    calibrations = {}
+
+    def __init__(self, steps: int, units: float):
+        """
+
+        :param steps: number of the motor steps
+        :param units: corresponding distance in the units of the motor
+        """
+        self.steps = steps
+        self.units = units
+
+    @property
+    def step_size(self) -> float:
+        return self.units / self.steps
+
+    def to_steps(self, units: Union[float, np.ndarray]) -> Union[int, np.ndarray]:
+        """
+        :param units: position or array of positions in the units of the motor
+        :return: integer number of steps or int64 array
+        """
+        steps = np.rint(np.multiply(units, self.steps) / self.units)
+        if np.ndim(steps) == 0:
+            return int(steps)
+        return steps.astype(np.int64)
+
+    def to_units(self, steps: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+        """
+        :param steps: number or array of motor steps
+        :return: position in the units of the motor or float64 array
+        """
+        units = np.multiply(steps, self.units) / self.steps
+        if np.ndim(units) == 0:
+            return float(units)
+        return units
+
+    @classmethod
+    def set_calibrations(cls, calibrations: dict):
+        """
+        Set calibrations of the motors.
+
+        :param calibrations: dict {motor_id: (steps, units)}
+        :return: None
+        """
+        cls.calibrations = {motor: cls(*calibration) for motor, calibration in calibrations.items()}
+
+    @classmethod
+    def of(cls, motor: int) -> 'MotorCalibration':
+        return cls.calibrations[motor]
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.steps}, {self.units})'
+
+
 def rev_to_steps(rev: float) -> int:
-    return int(rev * 75000)  # TODO: 75000 determine in settings
+    return MotorCalibration.of(MOTOR_0).to_steps(rev)
 
 
 def distance_to_steps(distance: float) -> int:
-    # TODO: determine dependence of distance on motor step
-    return int(distance)
+    return MotorCalibration.of(MOTOR_3).to_steps(distance)
 
 
 def degree_to_steps(degree: float) -> int:
-    return int(round(degree / 0.01125))
+    return MotorCalibration.of(MOTOR_1).to_steps(degree)
 
 
 def step_to_revs(motor_step: int) -> float:
-    return motor_step / 75000
+    return MotorCalibration.of(MOTOR_0).to_units(motor_step)
 
 
 def step_to_degrees(motor_step: int) -> float:
-    return round(motor_step * 0.01125, 5)
+    return MotorCalibration.of(MOTOR_1).to_units(motor_step)
 
 
 def step_to_distance(motor_step: int) -> float:
-    # TODO: determine dependence of distance on motor step
-    return float(motor_step)
+    return MotorCalibration.of(MOTOR_3).to_units(motor_step)
 
 
-def to_motor_steps(motor: int, unit_steps: float) -> int:
-    return {
-        MOTOR_0: rev_to_steps(unit_steps),
-        **dict.fromkeys([MOTOR_1, MOTOR_2], degree_to_steps(unit_steps)),
-        MOTOR_3: distance_to_steps(unit_steps)
-    }[motor]
+def to_motor_steps(motor: int, unit_steps: Union[float, np.ndarray]) -> Union[int, np.ndarray]:
+    return MotorCalibration.of(motor).to_steps(unit_steps)
 
 
-def to_step_units(motor: int, motor_steps: int) -> float:
-    return {
-        MOTOR_0: step_to_revs(motor_steps),
-        **dict.fromkeys([MOTOR_1, MOTOR_2], step_to_degrees(motor_steps)),
-        MOTOR_3: step_to_distance(motor_steps)
-    }[motor]
+def to_step_units(motor: int, motor_steps: Union[int, np.ndarray]) -> Union[float, np.ndarray]:
+    return MotorCalibration.of(motor).to_units(motor_steps)
 
 
 def real_step(motor: int, step: float) -> float:
@@ -0,0 +1,85 @@
+import os
+
+
+class DataFileWriter:
+    """
+    Streaming writer of the tab-separated data files (DM_xxxx.txt, DS_xxxx.txt). The metadata header and the column
+    names are written once, then exactly one line is appended per measured point. Every line is flushed to the OS, so
+    a crash of the program loses at most the current point; `fsync_every` controls how often the file is also forced
+    to the disk (0 - only when the file is closed).
+
+    The format is the same as the one of `DataFrame.to_csv(sep='\\t', float_format='%.3f')` after the header:
+
+        # scan_type:	escan
+        # exposure:	1.0 s
+
+        reel [rev]	counter_1	counter_2
+        0.100	1520	340
+    """
+
+    def __init__(self, path: str, meta_data: dict, index_name: str, columns: list, fsync_every: int = 1,
+                 index: 'FileNumberIndex' = None):
+        """
+
+        :param path: path to the data file
+        :param meta_data: metadata written to the header of the file
+        :param index_name: name of the position column
+        :param columns: names of the counters
+        :param fsync_every: number of points after which the file is forced to the disk
+        :param index: index of the file numbers of the directory, to which the file is added when it is created
+        """
+        self.path = path
+        self.meta_data = meta_data
+        self.index_name = index_name
+        self.columns = list(columns)
+        self.fsync_every = fsync_every
+        self.index = index
+
+        self.points = 0
+        self._file = None
+
+    def _open(self):
+        # the file is created with the first point, so interrupted scans do not leave empty files
+        self._file = open(self.path, 'w')
+        for key, value in self.meta_data.items():
+            self._file.write(f'# {key}:\t{value}\n')   # definition of metadata string style
+        self._file.write('\n')
+        self._file.write('\t'.join([self.index_name or '', *self.columns]) + '\n')
+
+        if self.index is not None:
+            self.index.add(self.path)
+
+    def write_point(self, position: float, counts):
+        """
+        Append one line to the data file.
+
+        :param position: position of the motor
+        :param counts: values of the columns
+        :return: None
+        """
+        if self._file is None:
+            self._open()
+
+        self._file.write(f'{position:.3f}\t' + '\t'.join(map(str, counts)) + '\n')
+        self._file.flush()
+        self.points += 1
+
+        if self.fsync_every and self.points % self.fsync_every == 0:
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.path!r}, points={self.points})'
@@ -0,0 +1,116 @@
+import json
+import os
+import re
+from contextlib import contextmanager
+
+
+class FileNumberIndex:
+    """
+    Persistent index of the highest number of the data files (PREFIX_xxxx.txt) for each prefix in a directory.
+    It is kept in `.index/file_numbers.json` together with the modification time of the directory at the moment of the
+    last update. While the directory is not changed by anyone else, the next number is taken from the index without
+    listing the directory; a missing or stale index is rebuilt by one scan of the directory.
+
+    The index is kept in a subdirectory, so rewriting it does not change the modification time of the data directory.
+    """
+    DIRECTORY = '.index'
+    FILE_NAME = 'file_numbers.json'
+    FILE_PATTERN = re.compile(r'^(.+)_(\d+)\.txt$')
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path = os.path.join(directory, self.DIRECTORY, self.FILE_NAME)
+        self.numbers = None     # {prefix: highest number}, None - not loaded yet
+        self.mtime = None
+
+    def last_number(self, prefix: str) -> int:
+        """
+        :param prefix: prefix of the data files, e.g. 'DM'
+        :return: highest number of the data files with the prefix, 0 if there are none
+        """
+        if self.numbers is None:
+            self._load()
+        if self.mtime != self._directory_mtime():
+            self.rebuild()
+        return self.numbers.get(prefix, 0)
+
+    def add(self, path: str):
+        """
+        Register a data file created in the directory. It must be called after the file is created, so the stored
+        modification time of the directory includes the creation.
+
+        :param path: path to the data file
+        :return: None
+        """
+        match = self.FILE_PATTERN.match(os.path.basename(path))
+        if match is None:
+            return
+        if self.numbers is None:
+            self._load()
+
+        up_to_date = self.mtime is not None
+        prefix, number = match.group(1), int(match.group(2))
+        self.numbers[prefix] = max(self.numbers.get(prefix, 0), number)
+        if up_to_date:
+            self.save()
+        else:
+            self.rebuild()
+
+    @contextmanager
+    def writing(self):
+        """
+        Block, in which the program writes another file (not a data file) to the directory: the index stays valid after
+        the block, if it was valid before it.
+        """
+        if self.numbers is None:
+            self._load()
+        up_to_date = self.mtime is not None and self.mtime == self._directory_mtime()
+        yield
+        if up_to_date:
+            self.save()
+
+    def rebuild(self):
+        """
+        Rebuild the index from the names of the files in the directory.
+
+        :return: None
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        mtime = self._directory_mtime()
+        numbers = {}
+        for name in os.listdir(self.directory):
+            match = self.FILE_PATTERN.match(name)
+            if match is not None:
+                numbers[match.group(1)] = max(numbers.get(match.group(1), 0), int(match.group(2)))
+        self.numbers = numbers
+        self.save(mtime)
+
+    def _load(self):
+        self.numbers, self.mtime = {}, None
+        try:
+            with open(self.path) as file:
+                data = json.load(file)
+            self.numbers, self.mtime = data['numbers'], data['mtime']
+        except (OSError, ValueError, KeyError):
+            pass    # missing or damaged index is rebuilt
+
+    def _directory_mtime(self) -> int:
+        return os.stat(self.directory).st_mtime_ns
+
+    def save(self, mtime: int = None):
+        """
+        Write the index atomically.
+
+        :param mtime: modification time of the directory, to which the index corresponds, None - the current one
+        :return: None
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.mtime = self._directory_mtime() if mtime is None else mtime
+
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump({'mtime': self.mtime, 'numbers': self.numbers}, file, indent=1)
+        os.replace(temp_path, self.path)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.directory!r}, numbers={self.numbers})'
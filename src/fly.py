@@ -0,0 +1,44 @@
+import numpy as np
+
+
+def unwrap_counter(values, bits: int) -> np.ndarray:
+    """
+    Restore a monotonic sequence from the readings of a wrapping hardware counter. Between two readings the counter
+    must change by less than half of its range.
+
+    :param values: readings of the counter
+    :param bits: width of the counter
+    :return: int64 array, that starts with the first reading
+    """
+    values = np.asarray(values, dtype=np.int64)
+    period = 1 << bits
+    steps = (np.diff(values) + period // 2) % period - period // 2
+    return np.concatenate((values[:1], values[0] + np.cumsum(steps)))
+
+
+def bin_counts(progress: np.ndarray, times: np.ndarray, counts: np.ndarray, bins: int):
+    """
+    Distribute the cumulative counts sampled during a continuous move over equal position intervals.
+
+    The moments, when the motor crossed the edges of the intervals, are interpolated from the sampled positions, and the
+    cumulative counts at these moments are interpolated from the sampled counts. The counts are rounded at the edges,
+    so the sum of the bins equals the measured counts.
+
+    :param progress: positions of the samples in units of the interval, 0 - the start of the first interval
+    :param times: hardware times of the samples in seconds
+    :param counts: array of shape (number of samples, number of detectors) with the cumulative counts
+    :param bins: number of the intervals
+    :return: counts of the completely passed intervals (array of shape (intervals, detectors)) and their live times
+    """
+    change = np.flatnonzero(np.diff(progress))
+    if not len(change):
+        return np.empty((0, counts.shape[1]), dtype=np.int64), np.empty(0)
+
+    # the last sample at each position (the moment of leaving it), and the first one at the final position
+    keep = np.append(change, change[-1] + 1)
+    progress, times, counts = progress[keep], times[keep], counts[keep]
+
+    bins = min(bins, int(np.floor(progress[-1] + 1e-9)))
+    edge_times = np.interp(np.arange(bins + 1), progress, times)
+    edge_counts = np.rint(np.column_stack([np.interp(edge_times, times, column) for column in counts.T]))
+    return np.diff(edge_counts, axis=0).astype(np.int64), np.diff(edge_times)
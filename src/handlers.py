@@ -29,7 +29,7 @@ def convert_datatypes_to_func(func, *args) -> Union[list, None]:
     :return: list of converted arguments or None
     """
     f_param_types = list(func.__annotations__.values())  # list of types of the func parameters
-    defaults = func.__defaults__                         # tuple of the default parameters of the func or None
+    defaults = getattr(func, '__wrapped__', func).__defaults__   # default parameters of the func (also decorated)
     defaults = list(defaults) if defaults is not None else []
     len_pos_args = len(f_param_types) - len(defaults)    # length of the positional arguments of the func
 
@@ -68,7 +68,8 @@ def validate_and_log(scan_func):
             validate_motor(f_params['motor'], scan_func.__name__)
         if not f_params['step_num'] > 0:
             raise ValueError('Number of steps cannot be less than 0.')
-        validate_exposure(f_params['exposure'])
+        if 'exposure' in f_params:     # fly scans have no exposure
+            validate_exposure(f_params['exposure'])
         # TODO: add raise error for step and start/end positions
 
         f_params.pop('self', None)
@@ -112,6 +113,16 @@ def validate_exposure(exposure: float):
         raise DetectorException(f'Exposure must be in the range of [0.1, 999], your value is {exposure}.')
 
 
+def validate_budget(budget: int):
+    if budget < 0:
+        raise ValueError('Number of additional points cannot be less than 0.')
+
+
+def validate_relative_error(rel_error: float):
+    if not 0 < rel_error < 1:
+        raise ValueError(f'Relative error must be in the range of (0, 1), your value is {rel_error}.')
+
+
 def validate_photocathode_voltage(voltage: int):
     if not 0 <= voltage < 2048:
         raise ValueError(f'Voltage on the photocathode must be in the range of [0, 2048)')
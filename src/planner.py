@@ -0,0 +1,97 @@
+import numpy as np
+
+from .config import *
+from .convertor import to_motor_steps
+from .error_types import MotorException
+from .rsm500.rsm_controller import Motor
+
+
+class ScanPlan:
+    """
+    Trajectory of a motor scan computed before the scan starts. The positions of the points are converted to absolute
+    targets in motor steps in one vectorized call, so the rounding error does not accumulate over the steps, and the
+    moves between the points are split into commands of no more than MAX_STEPS steps. The scan loop only executes
+    `moves`.
+    """
+    MAX_STEPS = 32767   # the largest number of steps of one GM command
+
+    def __init__(self, motor_ids: list, positions: np.ndarray, targets: np.ndarray, start: list = None):
+        """
+
+        :param motor_ids: motors of the scan, the first one determines the positions
+        :param positions: positions of the points in the units of the first motor
+        :param targets: array of shape (number of points, number of motors) with the targets in motor steps
+        :param start: current positions of the motors in steps, if the motors are to be moved to the first point
+        """
+        self.motor_ids = list(motor_ids)
+        self.positions = positions
+        self.targets = targets
+        self.moves = [self._split(deltas) for deltas in np.diff(targets, axis=0).tolist()]
+        self.approach = self._split((targets[0] - start).tolist()) if start is not None else []
+
+    @classmethod
+    def build(cls, motor_id: int, start_val: float, steps_num: int, step_val: float,
+              motor2_id: int = None) -> 'ScanPlan':
+        """
+        Plan the scan of `steps_num` points from `start_val` with the step `step_val`. The second motor moves with
+        a twice greater step (theta - 2theta).
+
+        :return: ScanPlan
+        """
+        motor_ids = [motor_id] if motor2_id is None else [motor_id, motor2_id]
+        positions = start_val + np.arange(steps_num) * step_val
+        targets = np.column_stack([to_motor_steps(motor, positions * factor)
+                                   for factor, motor in enumerate(motor_ids, start=1)])
+        return cls(motor_ids, positions, targets)
+
+    def _split(self, deltas: list) -> list:
+        """
+        :param deltas: displacements of the motors in steps between two points
+        :return: list of moves (motor, direction, steps)
+        """
+        moves = []
+        for motor, delta in zip(self.motor_ids, deltas):
+            direction = DIRECTION['positive'][motor] if delta > 0 else DIRECTION['negative'][motor]
+            full, residual = divmod(abs(delta), self.MAX_STEPS)
+            moves.extend([(motor, direction, self.MAX_STEPS)] * full)
+            if residual:
+                moves.append((motor, direction, residual))
+        return moves
+
+    def validate(self, limits: dict):
+        """
+        Check all the targets against the limits of the motors.
+
+        :param limits: dict {motor_id: (lower limit, upper limit)} in motor steps, motors without limits are skipped
+        :return: None
+        """
+        for column, motor in enumerate(self.motor_ids):
+            if motor not in limits:
+                continue
+            lower, upper = limits[motor]
+            outside = np.flatnonzero((self.targets[:, column] < lower) | (self.targets[:, column] > upper))
+            if len(outside):
+                point = outside[0]
+                raise MotorException(f'Motor {motor} will exceed the limits [{lower}, {upper}] at the point {point} '
+                                     f'(position {self.targets[point, column]}).')
+
+    def duration(self, exposure: float, current: dict = None) -> float:
+        """
+        Estimate the duration of the scan from the speeds of the motors and the exposure.
+
+        :param exposure: exposure of each point in seconds
+        :param current: dict {motor_id: absolute position in steps}, if given the move to the start is included
+        :return: duration in seconds
+        """
+        travel = np.abs(np.diff(self.targets, axis=0)).sum(axis=0)
+        if current:
+            travel = travel + np.abs(self.targets[0] - [current.get(motor, self.targets[0, column])
+                                                        for column, motor in enumerate(self.motor_ids)])
+        moving = sum(steps / Motor.speeds[motor] for motor, steps in zip(self.motor_ids, travel.tolist()))
+        return moving + len(self) * exposure
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(motors={self.motor_ids}, points={len(self)})'
@@ -0,0 +1,57 @@
+import numpy as np
+
+
+def interval_scores(counts: np.ndarray) -> np.ndarray:
+    """
+    Score the intervals between neighbouring points by the significance of the change of the counts. The score of an
+    interval is the largest of the difference of the counts at its ends and the second differences at its ends, all in
+    units of their Poisson standard deviation, over all detectors.
+
+    :param counts: array of shape (number of points, number of detectors), the points are sorted by position
+    :return: scores of the (number of points - 1) intervals
+    """
+    y = counts.astype(np.float64)
+    scores = (np.abs(np.diff(y, axis=0)) / np.sqrt(y[:-1] + y[1:] + 1)).max(axis=1)
+    if len(y) > 2:
+        curvature = (np.abs(y[:-2] - 2 * y[1:-1] + y[2:]) / np.sqrt(y[:-2] + 4 * y[1:-1] + y[2:] + 1)).max(axis=1)
+        scores[:-1] = np.maximum(scores[:-1], curvature)     # the inner point is the right end of the interval
+        scores[1:] = np.maximum(scores[1:], curvature)       # and the left end of the next one
+    return scores
+
+
+def refinement_points(steps: np.ndarray, counts: np.ndarray, tolerance: float, budget: int) -> np.ndarray:
+    """
+    Choose the new points of a refinement round: the middles of the intervals, whose score exceeds the tolerance,
+    the most significant first. Intervals narrower than two motor steps cannot be split.
+
+    :param steps: positions of the measured points in motor steps
+    :param counts: array of shape (number of points, number of detectors) with the counts of the points
+    :param tolerance: smallest score of the refined interval, in Poisson standard deviations
+    :param budget: largest number of the new points
+    :return: positions of the new points in motor steps
+    """
+    order = np.argsort(steps, kind='stable')
+    steps, counts = steps[order], counts[order]
+    if len(steps) < 2:
+        return np.empty(0, dtype=np.int64)
+
+    scores = interval_scores(counts)
+    scores[np.diff(steps) < 2] = 0.
+    candidates = np.flatnonzero(scores > tolerance)
+    candidates = candidates[np.argsort(-scores[candidates], kind='stable')][:budget]
+    return (steps[candidates] + steps[candidates + 1]) // 2
+
+
+def travel_order(steps: np.ndarray, current: int) -> np.ndarray:
+    """
+    Order the points to visit them in one sweep starting from the end nearest to the current position, which is the
+    shortest path of the motor through the points.
+
+    :param steps: positions of the points in motor steps
+    :param current: current position of the motor in steps
+    :return: ordered positions
+    """
+    steps = np.sort(steps)
+    if len(steps) and abs(current - steps[-1]) < abs(current - steps[0]):
+        steps = steps[::-1]
+    return steps
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+
+class ScanResults:
+    """
+    Preallocated columnar storage of the results of a motor scan: positions of the motor (float) and counts of the
+    detectors (uint32). Points are appended at the fill cursor in O(1), a DataFrame is built only on request.
+
+    If the exposure differs from point to point, the live time of each point is stored too, and the data files get
+    the live time and the counts per second of each counter after the counts.
+    """
+
+    def __init__(self, size: int, columns: list, index_name: str = None, live_time: bool = False):
+        """
+
+        :param size: maximal number of points in the scan
+        :param columns: names of the counters
+        :param index_name: name of the position column
+        :param live_time: store the live time of each point
+        """
+        self.columns = list(columns)
+        self.index_name = index_name
+
+        self.positions = np.empty(size, dtype=np.float64)
+        self.counts = np.zeros((size, len(self.columns)), dtype=np.uint32)
+        self.live_times = np.zeros(size, dtype=np.float64) if live_time else None
+        self.size = 0   # fill cursor
+
+    @property
+    def capacity(self) -> int:
+        return len(self.positions)
+
+    @property
+    def cps_columns(self) -> list:
+        return [f'{column}_cps' for column in self.columns]
+
+    @property
+    def file_columns(self) -> list:
+        """
+        :return: names of the columns of the data files
+        """
+        if self.live_times is None:
+            return self.columns
+        return [*self.columns, 'live_time', *self.cps_columns]
+
+    @property
+    def file_dtypes(self) -> list:
+        """
+        :return: numpy types of the columns of the data files
+        """
+        if self.live_times is None:
+            return ['<u4'] * len(self.columns)
+        return ['<u4'] * len(self.columns) + ['<f8'] * (1 + len(self.columns))
+
+    def file_values(self, counts, live_time: float = None) -> list:
+        """
+        :param counts: counts of the detectors
+        :param live_time: live time of the point in seconds
+        :return: values of the columns of the data files
+        """
+        if self.live_times is None:
+            return list(counts)
+        return [*counts, f'{live_time:.3f}', *[f'{value / live_time:.3f}' for value in counts]]
+
+    def append(self, position: float, counts, live_time: float = None):
+        """
+        Add the point at the fill cursor.
+
+        :param position: position of the motor
+        :param counts: counts of the detectors in the order of columns
+        :param live_time: live time of the point in seconds, if the live times are stored
+        :return: None
+        """
+        if self.size == self.capacity:
+            raise IndexError(f'Results of the scan are full ({self.capacity} points).')
+
+        self.positions[self.size] = position
+        self.counts[self.size] = counts
+        if self.live_times is not None:
+            self.live_times[self.size] = live_time
+        self.size += 1
+
+    def sort(self):
+        """
+        Order the filled points by position.
+
+        :return: None
+        """
+        order = np.argsort(self.positions[:self.size], kind='stable')
+        self.positions[:self.size] = self.positions[order]
+        self.counts[:self.size] = self.counts[order]
+        if self.live_times is not None:
+            self.live_times[:self.size] = self.live_times[order]
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        :return: DataFrame of the filled points, indexed by the positions of the motor
+        """
+        df = pd.DataFrame(self.counts[:self.size],
+                          index=pd.Index(self.positions[:self.size], name=self.index_name),
+                          columns=self.columns)
+        if self.live_times is not None:
+            df['live_time'] = self.live_times[:self.size]
+            for column, cps_column in zip(self.columns, self.cps_columns):
+                df[cps_column] = df[column] / df['live_time']
+        return df
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.size}/{self.capacity}, columns={self.columns})'
@@ -0,0 +1,87 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+class SharedRingBuffer:
+    """
+    Circular buffer of rows (x, value_1, value_2, ...) in shared memory, that is written by the scan and read by the
+    plot process without pickling. The memory block holds the write cursor (int64, number of rows written since the
+    start) followed by the float64 rows.
+
+    One slot more than `capacity` is allocated, so that the reader never takes the slot being written.
+    """
+    HEADER = 8   # bytes of the cursor
+
+    def __init__(self, capacity: int, columns: int, name: str = None):
+        """
+        Create a new buffer or attach to an existing one.
+
+        :param capacity: number of the last rows available to the reader
+        :param columns: number of values in a row
+        :param name: name of the existing shared memory block, None - create a new one
+        """
+        self.capacity = capacity
+        self.columns = columns
+        self.slots = capacity + 1
+        size = self.HEADER + self.slots * columns * 8
+
+        self.owner = name is None
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+
+        self._cursor = np.ndarray((1,), dtype=np.int64, buffer=self._shm.buf)
+        self._rows = np.ndarray((self.slots, columns), dtype=np.float64, buffer=self._shm.buf, offset=self.HEADER)
+        if self.owner:
+            self._cursor[0] = 0
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    @property
+    def cursor(self) -> int:
+        return int(self._cursor[0])
+
+    def append(self, row):
+        """
+        Write the row at the cursor. The row is written before the cursor is moved, so the reader never sees
+        a partially written row.
+
+        :param row: values of the row
+        :return: None
+        """
+        cursor = self._cursor[0]
+        self._rows[cursor % self.slots] = row
+        self._cursor[0] = cursor + 1
+
+    def snapshot(self) -> np.ndarray:
+        """
+        :return: copy of the last rows (no more than capacity) in the order of writing
+        """
+        cursor = self.cursor
+        count = min(cursor, self.capacity)
+        start = (cursor - count) % self.slots
+        end = start + count
+        if end <= self.slots:
+            return self._rows[start:end].copy()
+        return np.concatenate((self._rows[start:], self._rows[:end - self.slots]))
+
+    def close(self):
+        """
+        Detach from the shared memory, the owner also frees it.
+
+        :return: None
+        """
+        del self._cursor, self._rows
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
+
+    def __len__(self):
+        return min(self.cursor, self.capacity)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.name!r}, {len(self)}/{self.capacity})'
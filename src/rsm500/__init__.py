@@ -1,2 +1,6 @@
-from .command import Command
-from .rsm_controller import RSMController, Motor, Detector
+from .command import Command, COMMANDS
+from .interruption import CANCEL, CancellationToken, InterruptListener
+from .metrics import METRICS, Metrics, MetricsExporter
+from .state import STATE, ControllerState
+from .rsm_controller import RSMController, Motor, Detector, DetectorGroup
+from .async_controller import AsyncRSMController, AsyncMotor, AsyncDetector
@@ -0,0 +1,130 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from src.rsm500.interruption import CANCEL
+from src.rsm500.metrics import METRICS
+from src.rsm500.rsm_controller import RSMController, Motor, Detector
+
+
+class AsyncRSMController:
+    """
+    Asyncio front-end of the RSM controller. Every method of the wrapped synchronous controller becomes a coroutine
+    function. The transactions are executed by a single worker that owns the serial port, so they never overlap and the
+    event loop is not blocked by the reads of the port. Waiting loops are reimplemented with `asyncio.sleep`.
+    """
+    _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rsm500-port')
+
+    def __init__(self, controller: RSMController = None):
+        self._controller = controller if controller is not None else RSMController()
+
+    async def call(self, func, *args):
+        """
+        Run a blocking function in the worker of the serial port.
+
+        :param func: function to be run
+        :param args: arguments of the function
+        :return: result of the function
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    @staticmethod
+    async def sleep_until(deadline: float) -> bool:
+        """
+        Sleep until the given moment without requests to the controller, checking the cancellation of the command.
+
+        :param deadline: moment in time.monotonic() seconds
+        :return: If interrupted - False, else True
+        """
+        remaining = deadline - time.monotonic()
+        while remaining > 0:
+            await asyncio.sleep(min(remaining, RSMController.COARSE_DELAY))
+            if CANCEL.cancelled:
+                return False
+            remaining = deadline - time.monotonic()
+        return True
+
+    def __getattr__(self, name):
+        attr = getattr(self._controller, name)
+        if not callable(attr):
+            return attr
+
+        async def method(*args):
+            return await self.call(attr, *args)
+
+        method.__name__ = name
+        method.__doc__ = attr.__doc__
+        return method
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self._controller!r})'
+
+
+class AsyncMotor(AsyncRSMController):
+
+    def __init__(self, motor: Motor = None):
+        super().__init__(motor if motor is not None else Motor())
+
+    async def is_moving(self):
+        """
+        Wait while motor is moving without blocking the event loop (see Motor.is_moving).
+
+        :return: If interrupted - False, else True
+        """
+        move = self._controller._move
+        if not await self.sleep_until(self._controller.expected_end(move)):
+            await self.stop()
+            return False
+
+        polls = 0
+        while await self.moving_status() & 1:
+            polls += 1
+            await asyncio.sleep(self.DELAY)
+            if CANCEL.cancelled:
+                await self.stop()
+                return False
+
+        if METRICS.enabled:
+            METRICS.count_polls('is_moving', polls + 1)
+        self._controller.calibrate(move, polls)
+        return True
+
+
+class AsyncDetector(AsyncRSMController):
+
+    def __init__(self, detector: Detector):
+        super().__init__(detector)
+
+    async def is_counting(self):
+        """
+        Wait while counter is working during set exposure time without blocking the event loop
+        (see Detector.is_counting).
+
+        :return: If interrupted - False, else True
+        """
+        if not await self.sleep_until(self._controller.expected_end()):
+            await self.stop_count()
+            return False
+
+        remaining = await self.get_remaining_exposure()
+        polls = 1
+        while remaining > 0:
+            if not await self.sleep_until(time.monotonic() + max((remaining - 1) / 10, self.DELAY)):
+                await self.stop_count()
+                return False
+            remaining = await self.get_remaining_exposure()
+            polls += 1
+
+        if METRICS.enabled:
+            METRICS.count_polls('is_counting', polls)
+        return True
+
+    async def read_counts(self, *detectors):
+        """
+        Read the results of the count in this and the given detectors in one transaction.
+
+        :param detectors: other Detector or AsyncDetector objects
+        :return: list of counts
+        """
+        detectors = [getattr(detector, '_controller', detector) for detector in detectors]
+        return await self.call(self._controller.read_counts, *detectors)
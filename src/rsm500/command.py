@@ -17,6 +17,12 @@ class Command:
         self.op_code = op_code
         self.arg_lengths = arg_lengths
 
+        # template of the frame, e.g. b'\x06GM%01d%05d\r', compiled once for the command
+        self._template = b'\x06' + op_code.encode() + b''.join(b'%%0%dd' % width for width in arg_lengths) + b'\r'
+        # frames of the commands without arguments or with one-digit arguments are cached as ready-to-write bytes
+        self._frames = {(): self._template} if not arg_lengths else {}
+        self._cacheable = all(width == 1 for width in arg_lengths)
+
     @property
     def response_length(self):
         """
@@ -29,15 +35,15 @@ class Command:
         """
 
         :param args: tuple, argument values (integers)
-        :return: string ready to be sent to the device
+        :return: bytes ready to be sent to the device
         """
-        assert isinstance(args, tuple)
-
-        result = '\x06' + self.op_code
-        for i in range(0, len(args)):
-            result += '{val:0{width}d}'.format(val=args[i], width=self.arg_lengths[i])
-        result += '\x0d'
-        return result
+        frame = self._frames.get(args)
+        if frame is None:
+            assert len(args) == len(self.arg_lengths)
+            frame = self._template % args
+            if self._cacheable:
+                self._frames[args] = frame
+        return frame
 
     def parse(self, response):
         """
@@ -50,3 +56,47 @@ class Command:
         assert isinstance(response, bytes)
 
         return self.return_struct.unpack(response)
+
+    def parse_from(self, buffer, offset: int = 0):
+        """
+        Decode the response directly from a buffer without copying it.
+
+        :param buffer: bytearray or memoryview filled by the port
+        :param offset: position of the response in the buffer
+        :return: tuple with result values
+        """
+        return self.return_struct.unpack_from(buffer, offset)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({self.op_code!r})'
+
+
+# Registry of all commands of the RSM500 controller. It is compiled once at import, so the frames and structs
+# are not rebuilt on every call.
+COMMANDS = {command.op_code: command for command in [
+    # device
+    Command('RB', 'B'),             # read status byte
+    Command('VS', 'BB'),            # version of the controller program
+    Command('RS', 'B'),             # software reset
+    Command('RE', 'B'),             # read error byte
+    # motor
+    Command('SM', 'B', 1),          # select motor
+    Command('RG', 'B'),             # motor status
+    Command('GI', 'B'),             # initialization of the motor
+    Command('GP', '>h'),            # get position
+    Command('GW', 'B', 5),          # write position
+    Command('GM', 'B', 1, 5),       # move
+    Command('GB', 'B'),             # stop
+    Command('GE', '>h'),            # step counter mismatch
+    # detectors
+    Command('TS', 'B', 1, 1, 4),    # set threshold
+    Command('TG', '>H', 1, 1),      # get threshold
+    Command('ES', 'B', 4),          # set exposure
+    Command('CS', 'B'),             # start count
+    Command('CB', 'B'),             # stop count
+    Command('CG', '>I', 1),         # read counts
+    Command('EG', '>H'),            # remaining exposure
+    Command('DS', 'B', 1, 4),       # set voltage on the photocathode
+    Command('DG', '>H', 1),         # get voltage on the photocathode
+    Command('DM', 'B', 1, 1),       # enable photocathode
+]}
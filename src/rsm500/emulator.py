@@ -0,0 +1,417 @@
+import argparse
+import math
+import os
+import select
+import socket
+import threading
+import time
+
+import numpy as np
+
+from src.config import DIRECTION, COUNTER, Settings
+from src.rsm500.command import COMMANDS
+
+
+class RSMEmulator:
+    """
+    Software emulator of the RSM500 controller. It speaks the same '\\x06<op><args>\\r' framing as the real
+    controller and is attached either to a pseudo-terminal (Linux) or to a TCP socket, so that
+    `RSMController.set_port(serial.Serial(emulator.open_pty()))` or
+    `RSMController.set_port(serial.serial_for_url(emulator.open_socket()))` work unchanged.
+
+    The hardware (motors and exposure) can be run faster than real time by `time_scale`, while the latency of the line
+    is always emulated in real time.
+    """
+    BITS_PER_BYTE = 10   # start bit, 8 data bits and stop bit
+
+    # status bits of the device (see RSMController.device_status)
+    STATUS_ERROR = 0x80
+    STATUS_COUNTING = 0x10
+    STATUS_MOTOR = 0x01
+
+    # status bits of the motor (see Motor.status), the limit switches and flags are not triggered
+    MOTOR_STATUS_IDLE = 0x40 | 0x20 | 0x02 | 0x01
+    MOTOR_STATUS_INITIALIZED = 0x04
+
+    def __init__(self,
+                 baudrate: int = 19200,
+                 line_latency: bool = True,
+                 step_rates: dict = None,
+                 count_rate=None,
+                 time_scale: float = 1.,
+                 seed: int = None):
+        """
+
+        :param baudrate: speed of the emulated line in bps, it determines latency per byte
+        :param line_latency: if False, responses are sent without delay
+        :param step_rates: dict {motor_id: steps per second}, the other motors move with the speeds from settings.ini
+        :param count_rate: CPS of all channels (float), dict {channel: CPS} or function (channel, positions) -> CPS,
+        where positions is a dict {motor_id: position in motor steps}
+        :param time_scale: how many times the emulated hardware runs faster than the real time
+        :param seed: seed of the random generator of the counts
+        """
+        self.byte_time = self.BITS_PER_BYTE / baudrate if line_latency else 0.
+        self.step_rates = Settings().get_motor_speeds()
+        self.step_rates.update(step_rates or {})
+        self.count_rate = count_rate if count_rate is not None else {COUNTER[1]: 1000., COUNTER[2]: 500.}
+        self.time_scale = time_scale
+        self.rng = np.random.default_rng(seed)
+
+        self.transactions = 0   # write/read round trips: bursts of frames received before the responses
+        self.frames = 0         # commands executed
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+        self._t0 = time.monotonic()
+        self._thread = None
+        self._running = False
+        self._read = self._write = self._close = None
+
+        self.reset()
+
+        self._handlers = {
+            'RB': self._device_status, 'VS': lambda: (1, 0), 'RS': self._reset, 'RE': lambda: self.error,
+            'SM': self._select, 'RG': self._motor_status, 'GI': self._initialize, 'GP': self._get_position,
+            'GW': self._set_position, 'GM': self._move, 'GB': self._stop, 'GE': lambda: 0,
+            'TS': self._set_threshold, 'TG': lambda det, level: self.thresholds[(det, level)],
+            'ES': self._set_exposure, 'CS': self._start_count, 'CB': self._stop_count, 'CG': self._read_counts,
+            'EG': self._get_exposure, 'DS': self._set_voltage, 'DG': lambda det: self.voltages[det],
+            'DM': self._enable_photocathode,
+        }
+
+    # ====================== Emulated hardware ======================
+
+    def now(self) -> float:
+        """
+        :return: emulated hardware time in seconds
+        """
+        return (time.monotonic() - self._t0) * self.time_scale
+
+    def reset(self):
+        self.error = 0
+        self.selected = 4
+        self.positions = {motor: 0 for motor in self.step_rates}
+        self.initialized = {motor: False for motor in self.step_rates}
+        self.motion = None                  # (motor, start time, start position, direction sign, steps)
+
+        self.thresholds = {(det, level): 0 for det in range(6) for level in range(2)}
+        self.voltages = {det: 0 for det in range(6)}
+        self.exposure = 0                   # in tenths of a second
+        self.count_start = None             # hardware time of the start of counters
+        self.count_stop = None              # hardware time of the end of counting
+        self.continuous = False
+        self.counts = {det: 0 for det in range(6)}
+        self._counted_until = 0.
+
+    def _position(self, motor: int) -> int:
+        if self.motion is None or self.motion[0] != motor:
+            return self.positions[motor]
+        _, start, position, sign, steps = self.motion
+        return position + sign * min(steps, int((self.now() - start) * self.step_rates[motor]))
+
+    def _update_motion(self):
+        if self.motion is None:
+            return
+        motor, start, position, sign, steps = self.motion
+        if (self.now() - start) * self.step_rates[motor] >= steps:
+            self.positions[motor] = position + sign * steps
+            self.motion = None
+
+    def _is_counting(self) -> bool:
+        if self.count_start is None:
+            return False
+        return self.continuous or self.now() < self.count_stop
+
+    def _accumulate_counts(self):
+        if self.count_start is None:
+            return
+        end = self.now() if self.continuous else min(self.now(), self.count_stop)
+        live_time = end - self._counted_until
+        if live_time <= 0:
+            return
+        positions = {motor: self._position(motor) for motor in self.positions}
+        for det in self.counts:
+            if callable(self.count_rate):
+                rate = self.count_rate(det, positions)
+            elif isinstance(self.count_rate, dict):
+                rate = self.count_rate.get(det, 0.)
+            else:
+                rate = self.count_rate
+            self.counts[det] = (self.counts[det] + int(self.rng.poisson(rate * live_time))) & 0xFFFFFFFF
+        self._counted_until = end
+
+    def _device_status(self):
+        self._update_motion()
+        status = self.STATUS_ERROR if self.error else 0
+        if self.motion is not None:
+            status |= self.STATUS_MOTOR
+        if self._is_counting():
+            status |= self.STATUS_COUNTING
+        return status
+
+    def _reset(self):
+        self.reset()
+        return 0
+
+    def _select(self, motor: int):
+        self._update_motion()
+        if self.motion is not None:
+            return self._fail(1)
+        self.selected = motor
+        return 0
+
+    def _motor_status(self):
+        if self.selected not in self.positions:
+            return self._fail(1)
+        status = self.MOTOR_STATUS_IDLE
+        if self.initialized[self.selected]:
+            status |= self.MOTOR_STATUS_INITIALIZED
+        return status
+
+    def _initialize(self):
+        if self.selected not in self.positions:
+            return self._fail(1)
+        self.positions[self.selected] = 0
+        self.initialized[self.selected] = True
+        return 0
+
+    def _get_position(self):
+        if self.selected not in self.positions:
+            return self._fail(0)
+        self._update_motion()
+        return (self._position(self.selected) + 32768) % 65536 - 32768   # 2-byte counter of the controller
+
+    def _set_position(self, position: int):
+        if self.selected not in self.positions or self.motion is not None:
+            return self._fail(1)
+        self.positions[self.selected] = position
+        self.initialized[self.selected] = False
+        return 0
+
+    def _move(self, direction: int, steps: int):
+        self._update_motion()
+        if self.selected not in self.positions or self.motion is not None:
+            return self._fail(1)
+        sign = 1 if DIRECTION['positive'][self.selected] == direction else -1
+        self.motion = (self.selected, self.now(), self.positions[self.selected], sign, steps)
+        return 0
+
+    def _stop(self):
+        if self.motion is not None:
+            motor = self.motion[0]
+            self.positions[motor] = self._position(motor)
+            self.motion = None
+        return 0
+
+    def _set_threshold(self, det: int, level: int, value: int):
+        self.thresholds[(det, level)] = value
+        return 0
+
+    def _set_exposure(self, value: int):
+        self.exposure = value
+        if value == 0:      # continuous mode is switched on immediately
+            self._start_count()
+        return 0
+
+    def _start_count(self):
+        self.counts = dict.fromkeys(self.counts, 0)
+        self.count_start = self._counted_until = self.now()
+        self.continuous = self.exposure == 0
+        self.count_stop = self.count_start + self.exposure / 10
+        return 0
+
+    def _stop_count(self):
+        self._accumulate_counts()
+        if self._is_counting():
+            self.count_stop = self.now()
+            self.continuous = False
+        return 0
+
+    def _read_counts(self, det: int):
+        self._accumulate_counts()
+        return self.counts[det]
+
+    def _get_exposure(self):
+        if self.count_start is None:
+            return 0
+        if self.continuous:
+            return int((self.now() - self.count_start) * 1000) % 65536
+        return max(0, math.ceil((self.count_stop - self.now()) * 10))
+
+    def _set_voltage(self, det: int, voltage: int):
+        self.voltages[det] = voltage
+        return 0
+
+    def _enable_photocathode(self, det: int, is_enabled: int):
+        return 0
+
+    def _fail(self, code: int):
+        self.error = 1
+        return code
+
+    # ====================== Protocol ======================
+
+    def respond(self, frame: bytes) -> bytes:
+        """
+        Execute one frame of the protocol and return the response of the controller.
+
+        :param frame: bytes b'\\x06<op><args>\\r'
+        :return: response bytes, empty if the command is unknown
+        """
+        op_code = frame[1:3].decode()
+        command = COMMANDS.get(op_code)
+        if command is None:
+            return b''
+
+        args, offset = [], 3
+        for width in command.arg_lengths:
+            args.append(int(frame[offset:offset + width]))
+            offset += width
+
+        result = self._handlers[op_code](*args)
+        return command.return_struct.pack(*(result if isinstance(result, tuple) else (result,)))
+
+    def _serve(self):
+        pending = b''
+        while self._running:
+            data = self._read()
+            if not data:
+                continue
+            pending += data
+
+            frames = self.frames
+            while b'\r' in pending:
+                start = pending.find(b'\x06')
+                if start < 0:
+                    pending = b''
+                    break
+                end = pending.index(b'\r', start) if b'\r' in pending[start:] else -1
+                if end < 0:
+                    pending = pending[start:]
+                    break
+                frame, pending = pending[start:end + 1], pending[end + 1:]
+
+                response = self.respond(frame)
+                self.frames += 1
+                self.bytes_received += len(frame)
+                self.bytes_sent += len(response)
+
+                if self.byte_time:
+                    time.sleep((len(frame) + len(response)) * self.byte_time)
+                self._write(response)
+
+            if self.frames > frames:    # the frames of a batch are written at once and read in one burst
+                self.transactions += 1
+
+    def _start(self, read, write, close):
+        self._read, self._write, self._close = read, write, close
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, name='rsm500-emulator', daemon=True)
+        self._thread.start()
+
+    def open_pty(self) -> str:
+        """
+        Attach the emulator to a new pseudo-terminal (Linux and macOS only).
+
+        :return: name of the port to be opened by serial.Serial
+        """
+        import pty
+        import tty
+
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+
+        def read():
+            ready, _, _ = select.select([master], [], [], 0.1)
+            return os.read(master, 1024) if ready else b''
+
+        def write(data):
+            os.write(master, data)
+
+        def close():
+            os.close(master)
+            os.close(slave)
+
+        self._start(read, write, close)
+        return os.ttyname(slave)
+
+    def open_socket(self, host: str = 'localhost', port: int = 0) -> str:
+        """
+        Attach the emulator to a TCP socket, that is understood by serial.serial_for_url.
+
+        :param host: host to listen on
+        :param port: port to listen on, 0 - any free port
+        :return: URL of the port, e.g. 'socket://localhost:50000'
+        """
+        server = socket.create_server((host, port))
+        server.settimeout(0.1)
+        connection = []
+
+        def read():
+            if not connection:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    return b''
+                conn.settimeout(0.1)
+                connection.append(conn)
+            try:
+                data = connection[0].recv(1024)
+            except socket.timeout:
+                return b''
+            if not data:    # client disconnected, wait for the next one
+                connection.pop().close()
+            return data
+
+        def write(data):
+            connection[0].sendall(data)
+
+        def close():
+            for conn in connection:
+                conn.close()
+            server.close()
+
+        self._start(read, write, close)
+        return f'socket://{host}:{server.getsockname()[1]}'
+
+    def close(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._close is not None:
+            self._close()
+            self._close = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(transactions={self.transactions}, frames={self.frames})'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulator of the RSM500 controller')
+    parser.add_argument('--baudrate', type=int, default=19200)
+    parser.add_argument('--no-latency', action='store_true', help='do not emulate latency of the line')
+    parser.add_argument('--socket', type=int, default=None, metavar='PORT', help='listen on a TCP port instead of pty')
+    parser.add_argument('--time-scale', type=float, default=1.)
+    args = parser.parse_args()
+
+    emulator = RSMEmulator(baudrate=args.baudrate, line_latency=not args.no_latency, time_scale=args.time_scale)
+    port = emulator.open_pty() if args.socket is None else emulator.open_socket(port=args.socket)
+    print(f'RSM500 emulator is listening on {port}')
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.close()
+
+
+if __name__ == '__main__':
+    main()
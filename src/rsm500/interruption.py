@@ -0,0 +1,163 @@
+import logging
+import signal
+import socket
+import threading
+from contextlib import contextmanager
+
+import keyboard
+
+
+class CancellationToken:
+    """
+    Shared flag of the interruption of the running command. It is set by InterruptListener from another thread or from
+    a signal handler; the wait loops of the controller sleep on it, so they wake up as soon as it is set, and the scan
+    loops check it between the points by one attribute lookup.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self.active = False     # a command is running
+        self.reason = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = 'interrupted'):
+        self.reason = reason
+        self._event.set()
+
+    def clear(self):
+        self.reason = None
+        self._event.clear()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Sleep until the timeout or the cancellation.
+
+        :param timeout: time in seconds
+        :return: True if cancelled
+        """
+        return self._event.wait(timeout) if timeout > 0 else self._event.is_set()
+
+    @contextmanager
+    def scope(self):
+        """
+        Mark the block as a running command: the earlier cancellation is cleared at the start.
+        """
+        self.clear()
+        self.active = True
+        try:
+            yield self
+        finally:
+            self.active = False
+
+    def __bool__(self):
+        return self.cancelled
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(cancelled={self.cancelled}, reason={self.reason!r})'
+
+
+class InterruptListener:
+    """
+    Sources of the interruption, that set the cancellation token without polling:
+
+    - the hot key, registered as a hook of the `keyboard` module (needs root or an input device on Linux);
+    - SIGINT (Ctrl+C): it cancels the running command, at the prompt it raises KeyboardInterrupt as usual, as well as
+      the second SIGINT, if the command has not stopped after the first one;
+    - the local control socket: a line 'stop' sent to 127.0.0.1:<port> cancels the running command, e.g.
+      `echo stop | nc 127.0.0.1 5500`.
+
+    The sources, that cannot be set up, are skipped with a warning.
+    """
+
+    def __init__(self, token: CancellationToken, key: str = None, sigint: bool = True, port: int = None):
+        """
+
+        :param token: token to be set
+        :param key: hot key, e.g. 'ctrl+q', None - no hot key
+        :param sigint: cancel the running command by SIGINT
+        :param port: port of the control socket on 127.0.0.1, None - no socket
+        """
+        self.token = token
+        self.key = key
+        self.sigint = sigint
+        self.port = port
+
+        self._hotkey = None
+        self._previous_handler = None
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        log = logging.getLogger()
+
+        if self.key:
+            try:
+                self._hotkey = keyboard.add_hotkey(self.key, self.token.cancel, args=(self.key,))
+            except (ImportError, OSError, AssertionError, ValueError) as message:
+                log.warning(f'Interruption by {self.key} is not available: {message}')
+
+        if self.sigint:
+            if threading.current_thread() is threading.main_thread():
+                self._previous_handler = signal.signal(signal.SIGINT, self._on_sigint)
+            else:
+                log.warning('Interruption by SIGINT is available only in the main thread.')
+
+        if self.port:
+            try:
+                self._server = socket.create_server(('127.0.0.1', self.port))
+            except OSError as message:
+                log.warning(f'Control socket on the port {self.port} is not available: {message}')
+            else:
+                self._thread = threading.Thread(target=self._serve, name='interrupt-listener', daemon=True)
+                self._thread.start()
+        return self
+
+    def _on_sigint(self, signum, frame):
+        # the second Ctrl+C stops a command, that does not check the token (e.g. blocked in a read of the port)
+        if not self.token.active or self.token.cancelled:
+            raise KeyboardInterrupt
+        self.token.cancel('SIGINT')
+
+    def _serve(self):
+        while True:
+            try:
+                connection, _ = self._server.accept()
+            except OSError:     # the socket is closed
+                return
+            with connection:
+                connection.settimeout(1.)
+                try:
+                    request = connection.recv(64).strip().lower()
+                    if request == b'stop':
+                        self.token.cancel('control socket')
+                        connection.sendall(b'ok\n' if self.token.active else b'idle\n')
+                    else:
+                        connection.sendall(b'unknown command\n')
+                except OSError:
+                    pass
+
+    def stop(self):
+        if self._hotkey is not None:
+            keyboard.remove_hotkey(self._hotkey)
+            self._hotkey = None
+        if self._previous_handler is not None:
+            signal.signal(signal.SIGINT, self._previous_handler)
+            self._previous_handler = None
+        if self._server is not None:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)     # wakes up the accept of the listening thread
+            except OSError:
+                pass
+            self._server.close()
+            self._thread.join(timeout=1.)
+            self._server = None
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(key={self.key!r}, sigint={self.sigint}, port={self.port})'
+
+
+# cancellation of the running command shared by the controller and the scans
+CANCEL = CancellationToken()
@@ -0,0 +1,186 @@
+import bisect
+import math
+import os
+import threading
+
+
+class OpcodeStats:
+    """
+    Counters of one opcode (or of one combination of opcodes sent in a batch): number of calls, bytes sent and
+    received, and the histogram of the latency of the transaction.
+    """
+    # upper bounds of the latency buckets in seconds, the last bucket is unbounded
+    BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5.)
+
+    def __init__(self):
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.latency_sum = 0.
+        self.buckets = [0] * (len(self.BUCKETS) + 1)
+
+    def observe(self, sent: int, received: int, latency: float):
+        self.calls += 1
+        self.bytes_sent += sent
+        self.bytes_received += received
+        self.latency_sum += latency
+        self.buckets[bisect.bisect_left(self.BUCKETS, latency)] += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate the quantile of the latency by the linear interpolation inside its bucket.
+
+        :param q: quantile, e.g. 0.99
+        :return: latency in seconds, nan if there were no calls
+        """
+        if not self.calls:
+            return math.nan
+        rank = q * self.calls
+        cumulative = 0
+        for i, count in enumerate(self.buckets):
+            if cumulative + count >= rank and count:
+                lower = self.BUCKETS[i - 1] if i > 0 else 0.
+                upper = self.BUCKETS[i] if i < len(self.BUCKETS) else self.BUCKETS[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.BUCKETS[-1]
+
+    def summary(self) -> dict:
+        return {
+            'calls': self.calls,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'mean': self.latency_sum / self.calls if self.calls else math.nan,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics:
+    """
+    Instrumentation of the transactions with the controller and of the poll loops. It is switched off by default;
+    while `enabled` is False the controller only checks this flag, so the instrumentation costs one attribute lookup
+    per transaction.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.opcodes = {}   # {opcode or 'OP+OP+...' for a batch: OpcodeStats}
+        self.polls = {}     # {name of the poll loop: number of the requests}
+        self._lock = threading.Lock()
+
+    def observe(self, op_code: str, sent: int, received: int, latency: float):
+        """
+        Record one transaction.
+
+        :param op_code: opcode of the command, or opcodes of the batch joined by '+'
+        :param sent: bytes written to the port
+        :param received: bytes read from the port
+        :param latency: time from the write to the end of the read in seconds
+        :return: None
+        """
+        with self._lock:
+            stats = self.opcodes.get(op_code)
+            if stats is None:
+                stats = self.opcodes[op_code] = OpcodeStats()
+            stats.observe(sent, received, latency)
+
+    def count_polls(self, loop: str, polls: int):
+        with self._lock:
+            self.polls[loop] = self.polls.get(loop, 0) + polls
+
+    def summary(self) -> dict:
+        """
+        :return: dict {'opcodes': {opcode: summary of OpcodeStats}, 'polls': {loop: number of the requests}}
+        """
+        with self._lock:
+            return {'opcodes': {op_code: stats.summary() for op_code, stats in sorted(self.opcodes.items())},
+                    'polls': dict(self.polls)}
+
+    def reset(self):
+        with self._lock:
+            self.opcodes = {}
+            self.polls = {}
+
+    def to_prometheus(self) -> str:
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        lines = []
+        with self._lock:
+            opcodes = sorted(self.opcodes.items())
+            polls = sorted(self.polls.items())
+
+            lines += ['# HELP rsm500_commands_total Transactions with the controller.',
+                      '# TYPE rsm500_commands_total counter']
+            lines += [f'rsm500_commands_total{{op="{op}"}} {stats.calls}' for op, stats in opcodes]
+            lines += ['# HELP rsm500_bytes_sent_total Bytes written to the port.',
+                      '# TYPE rsm500_bytes_sent_total counter']
+            lines += [f'rsm500_bytes_sent_total{{op="{op}"}} {stats.bytes_sent}' for op, stats in opcodes]
+            lines += ['# HELP rsm500_bytes_received_total Bytes read from the port.',
+                      '# TYPE rsm500_bytes_received_total counter']
+            lines += [f'rsm500_bytes_received_total{{op="{op}"}} {stats.bytes_received}' for op, stats in opcodes]
+
+            lines += ['# HELP rsm500_latency_seconds Latency of the transactions.',
+                      '# TYPE rsm500_latency_seconds histogram']
+            for op, stats in opcodes:
+                cumulative = 0
+                for bound, count in zip([*OpcodeStats.BUCKETS, '+Inf'], stats.buckets):
+                    cumulative += count
+                    lines.append(f'rsm500_latency_seconds_bucket{{op="{op}",le="{bound}"}} {cumulative}')
+                lines.append(f'rsm500_latency_seconds_sum{{op="{op}"}} {stats.latency_sum:.6f}')
+                lines.append(f'rsm500_latency_seconds_count{{op="{op}"}} {stats.calls}')
+
+            lines += ['# HELP rsm500_latency_quantile_seconds Latency quantiles estimated from the histogram.',
+                      '# TYPE rsm500_latency_quantile_seconds gauge']
+            for op, stats in opcodes:
+                for q in (0.5, 0.99):
+                    lines.append(f'rsm500_latency_quantile_seconds{{op="{op}",quantile="{q}"}} '
+                                 f'{stats.quantile(q):.6f}')
+
+            lines += ['# HELP rsm500_polls_total Status requests in the poll loops.',
+                      '# TYPE rsm500_polls_total counter']
+            lines += [f'rsm500_polls_total{{loop="{loop}"}} {count}' for loop, count in polls]
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, path: str):
+        """
+        Write the metrics atomically to a file for the textfile collector of the Prometheus node exporter.
+
+        :param path: path to the .prom file
+        :return: None
+        """
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+class MetricsExporter:
+    """
+    Thread, that writes the metrics to the text file every `interval` seconds and once more when it is stopped.
+    """
+
+    def __init__(self, metrics: Metrics, path: str, interval: float = 15.):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-exporter', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.metrics.write_textfile(self.path)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.metrics.write_textfile(self.path)
+
+
+# metrics of all the controllers in the process
+METRICS = Metrics()
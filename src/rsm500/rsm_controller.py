@@ -1,17 +1,25 @@
 import time
 
-import keyboard
+import numpy as np
 import serial
 
-from src.config import KEY_FOR_INTERRUPTION
-from src.rsm500 import Command
+from src.config import LOWER_THRESHOLD, UPPER_THRESHOLD
+from src.rsm500.command import Command, COMMANDS
+from src.rsm500.interruption import CANCEL
+from src.rsm500.metrics import METRICS
+from src.rsm500.state import STATE
 
 
 class RSMController:
     DELAY = 0.01
+    COARSE_DELAY = 0.05     # period of checking the interruption by the asyncio front-end
 
     port = None
 
+    # reusable buffer for the responses of the controller, it is filled by `readinto` of the port
+    _buffer = bytearray(64)
+    _view = memoryview(_buffer)
+
     @classmethod
     def set_port(cls, port: serial.Serial):
         """
@@ -21,6 +29,7 @@ class RSMController:
         :return: None
         """
         cls.port = port
+        STATE.invalidate()
 
     def run_command(self, command: Command, *args: int):
         """
@@ -32,16 +41,92 @@ class RSMController:
         """
         out_cmd = command.format(*args)
 
-        if self.port is None:
+        port = self.port
+        if port is None:
+            raise ValueError('RSM500: port is not set')
+
+        measured = METRICS.enabled
+        started = time.perf_counter() if measured else 0.
+
+        port.write(out_cmd)
+        size = command.response_length
+        received = port.readinto(self._view[:size])
+        if measured:
+            METRICS.observe(command.op_code, len(out_cmd), received, time.perf_counter() - started)
+        if received != size:
+            STATE.invalidate()
+            raise ValueError(f'RSM500: {command.op_code} expected {size} bytes, received {received}')
+
+        result = self._unpack(command, 0)
+        STATE.update(command.op_code, args, result)
+        return result
+
+    def run_batch(self, *calls: tuple) -> list:
+        """
+        Run several commands in one transaction. All frames are written to the port by a single write, then the
+        combined response of the known length is read and split back into the results of each command.
+
+        :param calls: tuples (Command object, *arguments)
+        :return: list of results of the commands in the order of calls
+        """
+        port = self.port
+        if port is None:
             raise ValueError('RSM500: port is not set')
 
-        self.port.write(out_cmd.encode())
-        response = self.__class__.port.read(size=command.response_length)
-        result = command.parse(response)
+        out_cmd = b''.join([command.format(*args) for command, *args in calls])
+        size = sum(call[0].response_length for call in calls)
+        self._reserve(size)
+
+        measured = METRICS.enabled
+        started = time.perf_counter() if measured else 0.
+
+        port.write(out_cmd)
+        received = port.readinto(self._view[:size])
+        if measured:    # a batch is recorded as one transaction under its combination of opcodes
+            METRICS.observe('+'.join(call[0].op_code for call in calls), len(out_cmd), received,
+                            time.perf_counter() - started)
+        if received != size:
+            STATE.invalidate()
+            raise ValueError(f'RSM500: batch of {len(calls)} commands expected {size} bytes, received {received}')
+
+        results = []
+        offset = 0
+        for command, *args in calls:
+            result = self._unpack(command, offset)
+            STATE.update(command.op_code, args, result)
+            results.append(result)
+            offset += command.response_length
+        return results
+
+    @staticmethod
+    def _reserve(size: int):
+        """
+        Enlarge the response buffer if it is smaller than the given size.
+
+        :param size: number of bytes to be placed in the buffer
+        :return: None
+        """
+        if len(RSMController._buffer) < size:
+            RSMController._buffer = bytearray(size)
+            RSMController._view = memoryview(RSMController._buffer)
+
+    def _unpack(self, command: Command, offset: int):
+        result = command.parse_from(self._buffer, offset)
         if len(result) == 1:
             return result[0]
         return result
 
+    @staticmethod
+    def sleep_until(deadline: float) -> bool:
+        """
+        Sleep until the given moment without requests to the controller. The sleep ends at once, if the command is
+        cancelled.
+
+        :param deadline: moment in time.monotonic() seconds
+        :return: If interrupted - False, else True
+        """
+        return not CANCEL.wait(deadline - time.monotonic())
+
     def device_status(self):
         """
         Read status byte. The contents of this byte shows which devices of the spectrometer are "busy" at the given
@@ -58,7 +143,7 @@ class RSMController:
 
         :return: 1 byte
         """
-        return self.run_command(Command('RB', 'B'))
+        return self.run_command(COMMANDS['RB'])
 
     def device_version(self):
         """
@@ -66,7 +151,7 @@ class RSMController:
 
         :return: Returns 2 bytes. The high byte is the "high" part of the version number, the low byte is the low one.
         """
-        (high, low) = self.run_command(Command('VS', 'BB'))
+        (high, low) = self.run_command(COMMANDS['VS'])
         return '{}.{}'.format(high, low)
 
     def device_reset(self):
@@ -75,7 +160,7 @@ class RSMController:
 
         :return: Error code 1 byte
         """
-        return self.run_command(Command('RS', 'B'))
+        return self.run_command(COMMANDS['RS'])
 
     def device_get_error(self):
         """
@@ -83,7 +168,7 @@ class RSMController:
 
         :return: Last error code (1 byte). If there are no errors, it returns zero.
         """
-        return self.run_command(Command('RE', 'B'))
+        return self.run_command(COMMANDS['RE'])
 
     def __repr__(self):
         return f'{self.__class__.__name__}, port={self.port}'
@@ -92,10 +177,27 @@ class RSMController:
 class Motor(RSMController):
     motor_id = 4    # 4 is non-existent motor
 
+    # speeds of the motors in steps per second, loaded from settings.ini [MOTOR_SPEED] with `set_speeds` when Scan is
+    # created and refined after each move; without the speed of a motor its status is polled from the start of a move
+    speeds = {}
+    SPEED_MARGIN = 0.9      # fraction of the expected duration of a move, after which the status is polled
+
+    _move = None    # (motor id, steps, start time) of the last move
+
     def __init__(self, motor_id: int = None):
         if motor_id is not None:
             self.select(motor_id)
 
+    @classmethod
+    def set_speeds(cls, speeds: dict):
+        """
+        Set initial speeds of the motors.
+
+        :param speeds: dict {motor_id: steps per second}
+        :return: None
+        """
+        cls.speeds = dict(speeds)
+
     def select(self, motor_id: int):
         """
         Select motor.
@@ -108,10 +210,13 @@ class Motor(RSMController):
         - 4 - remove voltage from a motor
 
         :param motor_id: motor identifier (0-4)
-        :return: Error code (1 byte)
+        :return: Error code (1 byte), 0 if the motor is already selected
         """
         self.__class__.motor_id = motor_id
-        return self.run_command(Command('SM', 'B', 1), self.motor_id)
+        if STATE.is_selected(motor_id):
+            STATE.skip('SM')
+            return 0
+        return self.run_command(COMMANDS['SM'], self.motor_id)
 
     def status(self):
         """
@@ -128,7 +233,7 @@ class Motor(RSMController):
 
         :return: 1 byte
         """
-        return self.run_command(Command('RG', 'B'))
+        return self.run_command(COMMANDS['RG'])
 
     def initialize(self):
         """
@@ -136,15 +241,20 @@ class Motor(RSMController):
 
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('GI', 'B'))
+        return self.run_command(COMMANDS['GI'])
 
     def get_position(self):
         """
-        Reading the position of the motor.
+        Reading the position of the motor. The position known from the previous commands is returned without
+        a request.
 
         :return: Current motor position (2 bytes) - signed integer
         """
-        return self.run_command(Command('GP', '>h'))
+        position = STATE.position()
+        if position is not None:
+            STATE.skip('GP')
+            return position
+        return self.run_command(COMMANDS['GP'])
 
     def set_position(self, position: int):
         """
@@ -154,7 +264,7 @@ class Motor(RSMController):
         :param position: Numerical representation of the position to be set
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('GW', 'B', 5), position)
+        return self.run_command(COMMANDS['GW'], position)
 
     def move(self, direction_id: int, steps: int):
         """
@@ -164,7 +274,36 @@ class Motor(RSMController):
         :param steps: Number of steps, no more than 32768
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('GM', 'B', 1, 5), direction_id, steps)
+        result = self.run_command(COMMANDS['GM'], direction_id, steps)
+        self.__class__._move = (self.motor_id, steps, time.monotonic())
+        return result
+
+    def select_and_move(self, motor_id: int, direction_id: int, steps: int):
+        """
+        Select the motor, read its position and start moving in one transaction. The selection and the reading of
+        the position are skipped, if they are known from the previous commands.
+
+        :param motor_id: motor identifier (0-4)
+        :param direction_id: Direction of motor rotation
+        :param steps: Number of steps, no more than 32768
+        :return: Position of the motor before moving
+        """
+        self.__class__.motor_id = motor_id
+        calls = []
+        if STATE.is_selected(motor_id):
+            STATE.skip('SM')
+        else:
+            calls.append((COMMANDS['SM'], motor_id))
+
+        position = STATE.position() if not calls else None
+        if position is None:
+            calls.append((COMMANDS['GP'],))
+        else:
+            STATE.skip('GP')
+
+        results = self.run_batch(*calls, (COMMANDS['GM'], direction_id, steps))
+        self.__class__._move = (motor_id, steps, time.monotonic())
+        return position if position is not None else results[-2]
 
     def stop(self):
         """
@@ -172,21 +311,72 @@ class Motor(RSMController):
 
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('GB', 'B'))
+        return self.run_command(COMMANDS['GB'])
 
     def is_moving(self):
         """
-        Wait while motor is moving.
+        Wait while motor is moving. The status is not requested until the expected end of the last move (its steps
+        divided by the speed of the motor), after that it is polled every DELAY seconds.
 
         :return: If interrupted - False, else True
         """
-        while self.device_status() & 1:
-            time.sleep(self.DELAY)
-            if keyboard.is_pressed(KEY_FOR_INTERRUPTION):
+        move = self._move
+        if not self.sleep_until(self.expected_end(move)):
+            self.stop()
+            return False
+
+        polls = 0
+        while self.moving_status() & 1:
+            polls += 1
+            if CANCEL.wait(self.DELAY):
                 self.stop()
                 return False
+
+        if METRICS.enabled:
+            METRICS.count_polls('is_moving', polls + 1)
+        self.calibrate(move, polls)
         return True
 
+    def moving_status(self):
+        """
+        Read the status of the device together with the position of the selected motor in one transaction, so the
+        position, at which the motor has stopped, is known from the controller without another request.
+
+        :return: Status byte of the device (see RSMController.device_status)
+        """
+        return self.run_batch((COMMANDS['RB'],), (COMMANDS['GP'],))[0]
+
+    def expected_end(self, move: tuple) -> float:
+        """
+        Moment, after which the status of the motor should be polled.
+
+        :param move: (motor id, steps, start time) of the move
+        :return: moment in time.monotonic() seconds
+        """
+        if move is None or move[0] not in self.speeds:
+            return 0.
+        motor_id, steps, start = move
+        return start + self.SPEED_MARGIN * steps / self.speeds[motor_id]
+
+    def calibrate(self, move: tuple, polls: int):
+        """
+        Refine the speed of the motor after the move.
+
+        :param move: (motor id, steps, start time) of the finished move
+        :param polls: number of the status requests, that showed the motor moving
+        :return: None
+        """
+        self.__class__._move = None
+        if move is None or move[0] not in self.speeds or move[1] == 0:
+            return
+        motor_id, steps, start = move
+
+        if polls:   # the end of the move was observed, so its duration is known to within DELAY
+            measured = steps / max(time.monotonic() - start, self.DELAY)
+            self.speeds[motor_id] = 0.7 * self.speeds[motor_id] + 0.3 * measured
+        else:       # the motor had stopped before the first request, so its speed is underestimated
+            self.speeds[motor_id] *= 1.2
+
     def error(self):
         """
         Reading the value of the step counter mismatch during re-initialization. Returns the value of the counter of
@@ -196,7 +386,7 @@ class Motor(RSMController):
 
         :return: The value of the steps counter
         """
-        return self.run_command(Command('GE', '>h'))
+        return self.run_command(COMMANDS['GE'])
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.motor_id})'
@@ -205,6 +395,9 @@ class Motor(RSMController):
 class Detector(RSMController):
     MAX_DETECTORS = 6
 
+    _exposure = 0       # exposure of all the detectors in tenths of a second
+    _count_end = None   # expected end of the count in time.monotonic() seconds
+
     def __init__(self, detector_id: int):
         self.detector_id = detector_id
 
@@ -216,16 +409,20 @@ class Detector(RSMController):
         :param value: Threshold value
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('TS', 'B', 1, 1, 4), self.detector_id, threshold_id, value)
+        return self.run_command(COMMANDS['TS'], self.detector_id, threshold_id, value)
 
     def get_threshold(self, threshold_id: int):
         """
-        Get one detector threshold.
+        Get one detector threshold. The threshold known from the previous commands is returned without a request.
 
         :param threshold_id: Threshold (0 - bottom, 1 - up)
-        :return: Error code (1 byte)
+        :return: Threshold value
         """
-        return self.run_command(Command('TG', '>H', 1, 1), self.detector_id, threshold_id)
+        value = STATE.threshold(self.detector_id, threshold_id)
+        if value is not None:
+            STATE.skip('TG')
+            return value
+        return self.run_command(COMMANDS['TG'], self.detector_id, threshold_id)
 
     def set_exposure(self, value: int):
         """
@@ -233,9 +430,13 @@ class Detector(RSMController):
 
         :param value: Exposure value in tenths of a second (0 - 9999). If zero exposure is set, the counters
         immediately (without the ''counter_start' command) are switched on to the continuous operation mode
-        :return: Error code (1 byte)
+        :return: Error code (1 byte), 0 if the exposure is already set
         """
-        return self.run_command(Command('ES', 'B', 4), value)
+        self.__class__._exposure = value
+        if STATE.has_exposure(value):
+            STATE.skip('ES')
+            return 0
+        return self.run_command(COMMANDS['ES'], value)
 
     def start_count(self):
         """
@@ -243,7 +444,25 @@ class Detector(RSMController):
 
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('CS', 'B'))
+        result = self.run_command(COMMANDS['CS'])
+        self.__class__._count_end = time.monotonic() + self._exposure / 10
+        return result
+
+    def start_exposure(self, value: int):
+        """
+        Set exposure and start a count in one transaction. The exposure is not sent, if it is already set.
+
+        :param value: Exposure value in tenths of a second (1 - 9999)
+        :return: Error codes of the both commands
+        """
+        if STATE.has_exposure(value):
+            STATE.skip('ES')
+            result = [0, self.run_command(COMMANDS['CS'])]
+        else:
+            result = self.run_batch((COMMANDS['ES'], value), (COMMANDS['CS'],))
+        self.__class__._exposure = value
+        self.__class__._count_end = time.monotonic() + value / 10
+        return result
 
     def stop_count(self):
         """
@@ -251,28 +470,55 @@ class Detector(RSMController):
 
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('CB', 'B'))
+        return self.run_command(COMMANDS['CB'])
 
     def is_counting(self):
         """
-        Wait while counter is working during set exposure time.
+        Wait while counter is working during set exposure time. The remaining exposure is not requested until the
+        expected end of the count. If the count is not over yet, the next request is made at the last tenth of
+        a second of the remaining exposure, and then every DELAY seconds.
 
         :return: If interrupted - False, else True
         """
-        while self.get_remaining_exposure() > 0:
-            time.sleep(self.DELAY)
-            if keyboard.is_pressed(KEY_FOR_INTERRUPTION):
+        if not self.sleep_until(self.expected_end()):
+            self.stop_count()
+            return False
+
+        remaining = self.get_remaining_exposure()
+        polls = 1
+        while remaining > 0:
+            if not self.sleep_until(time.monotonic() + max((remaining - 1) / 10, self.DELAY)):
                 self.stop_count()
                 return False
+            remaining = self.get_remaining_exposure()
+            polls += 1
+
+        if METRICS.enabled:
+            METRICS.count_polls('is_counting', polls)
         return True
 
+    def expected_end(self) -> float:
+        """
+        :return: expected end of the count in time.monotonic() seconds
+        """
+        return self._count_end if self._count_end is not None else 0.
+
     def read_detector_count(self):
         """
         Reading the result of the count (a set of pulses) in the specified channel.
 
         :return: 4 bytes, unsigned integer
         """
-        return self.run_command(Command('CG', '>I', 1), self.detector_id)
+        return self.run_command(COMMANDS['CG'], self.detector_id)
+
+    def read_counts(self, *detectors: 'Detector') -> list:
+        """
+        Read the results of the count in this and the given detectors in one transaction.
+
+        :param detectors: other Detector objects
+        :return: list of counts, 4 bytes unsigned integer each
+        """
+        return self.run_batch(*[(COMMANDS['CG'], detector.detector_id) for detector in (self, *detectors)])
 
     def get_remaining_exposure(self):
         """
@@ -282,7 +528,7 @@ class Detector(RSMController):
 
         :return: 2 bytes - the value of the "remaining" exposure in tenths of a second.
         """
-        return self.run_command(Command('EG', '>H'))
+        return self.run_command(COMMANDS['EG'])
 
     def set_voltage_on_photocathode(self, voltage: int):
         """
@@ -291,15 +537,20 @@ class Detector(RSMController):
         :param voltage: Voltage on the photocathode of the detector
         :return: Error code (1 byte)
         """
-        return self.run_command(Command('DS', 'B', 1, 4), self.detector_id, voltage)
+        return self.run_command(COMMANDS['DS'], self.detector_id, voltage)
 
     def get_voltage_on_photocathode(self):
         """
-        Read the current voltage on the photocathode of the detector.
+        Read the current voltage on the photocathode of the detector. The voltage known from the previous commands is
+        returned without a request.
 
         :return: Photocathode voltage (2 bytes, unsigned integer)
         """
-        return self.run_command(Command('DG', '>H', 1), self.detector_id)
+        voltage = STATE.voltage(self.detector_id)
+        if voltage is not None:
+            STATE.skip('DG')
+            return voltage
+        return self.run_command(COMMANDS['DG'], self.detector_id)
 
     def enable_photocathode(self, is_enabled: bool):
         """
@@ -313,7 +564,118 @@ class Detector(RSMController):
         :return: Error code (1 byte)
         """
         en_val = 1 if is_enabled else 0
-        return self.run_command(Command('DM', 'B', 1, 1), self.detector_id, en_val)
+        return self.run_command(COMMANDS['DM'], self.detector_id, en_val)
 
     def __repr__(self):
         return f'{self.__class__.__name__}({self.detector_id})'
+
+
+class DetectorGroup:
+    """
+    Set of counter channels measured together, e.g. the detectors and the monitors. The counts of all the channels are
+    read in one transaction and returned as an array, so a channel added to the group does not add a transaction per
+    point. The thresholds and the voltages of the channels are taken from the state of the controller (ControllerState),
+    so they are requested once and then known from the commands, that set them; `refresh` requests them again.
+    """
+
+    def __init__(self, channels: dict):
+        """
+
+        :param channels: dict {name of the channel: detector identifier in the controller}, the first channel starts
+        the counts of all the channels
+        """
+        if not 0 < len(channels) <= Detector.MAX_DETECTORS:
+            raise ValueError(f'RSM500: from 1 to {Detector.MAX_DETECTORS} channels can be read, got {len(channels)}')
+        self.names = list(channels)
+        self.detectors = [Detector(detector_id) for detector_id in channels.values()]
+        self._read_calls = tuple((COMMANDS['CG'], detector.detector_id) for detector in self.detectors)
+
+    @property
+    def primary(self) -> Detector:
+        return self.detectors[0]
+
+    def __getitem__(self, name: str) -> Detector:
+        return self.detectors[self.names.index(name)]
+
+    def read_counts(self) -> np.ndarray:
+        """
+        Read the results of the count in all the channels in one transaction.
+
+        :return: array of the counts in the order of the channels
+        """
+        return np.array(self.primary.run_batch(*self._read_calls), dtype=np.int64)
+
+    def refresh(self):
+        """
+        Request the thresholds and the voltages of all the channels in one transaction.
+
+        :return: None
+        """
+        calls = []
+        for detector in self.detectors:
+            calls += [(COMMANDS['TG'], detector.detector_id, LOWER_THRESHOLD),
+                      (COMMANDS['TG'], detector.detector_id, UPPER_THRESHOLD),
+                      (COMMANDS['DG'], detector.detector_id)]
+        self.primary.run_batch(*calls)   # the values are stored in the state of the controller
+
+    def thresholds(self, name: str) -> tuple:
+        """
+        :param name: name of the channel
+        :return: (lower threshold, upper threshold) in mV
+        """
+        detector = self[name]
+        if None in (STATE.threshold(detector.detector_id, LOWER_THRESHOLD),
+                    STATE.threshold(detector.detector_id, UPPER_THRESHOLD)):
+            self.refresh()
+        return detector.get_threshold(LOWER_THRESHOLD), detector.get_threshold(UPPER_THRESHOLD)
+
+    def voltage(self, name: str) -> int:
+        """
+        :param name: name of the channel
+        :return: voltage on the photocathode in V
+        """
+        detector = self[name]
+        if STATE.voltage(detector.detector_id) is None:
+            self.refresh()
+        return detector.get_voltage_on_photocathode()
+
+    def set_thresholds(self, name: str, lower: int, upper: int):
+        """
+        Set both thresholds of the channel in one transaction.
+
+        :param name: name of the channel
+        :param lower: lower threshold in mV
+        :param upper: upper threshold in mV
+        :return: None
+        """
+        detector_id = self[name].detector_id
+        self.primary.run_batch((COMMANDS['TS'], detector_id, LOWER_THRESHOLD, lower),
+                               (COMMANDS['TS'], detector_id, UPPER_THRESHOLD, upper))
+
+    def set_voltage(self, name: str, voltage: int):
+        """
+        Set the voltage on the photocathode of the channel.
+
+        :param name: name of the channel
+        :param voltage: voltage in V
+        :return: None
+        """
+        self[name].set_voltage_on_photocathode(voltage)
+
+    def metadata(self) -> dict:
+        """
+        :return: dict {name of the channel: its identifier, thresholds and voltage} for the header of a data file
+        """
+        if any(None in (STATE.threshold(detector.detector_id, LOWER_THRESHOLD),
+                        STATE.threshold(detector.detector_id, UPPER_THRESHOLD), STATE.voltage(detector.detector_id))
+               for detector in self.detectors):
+            self.refresh()
+        return {name: f'channel {detector.detector_id}, thresholds {detector.get_threshold(LOWER_THRESHOLD)}-'
+                      f'{detector.get_threshold(UPPER_THRESHOLD)} mV, {detector.get_voltage_on_photocathode()} V'
+                for name, detector in zip(self.names, self.detectors)}
+
+    def __len__(self):
+        return len(self.detectors)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(zip(self.names, [d.detector_id for d in self.detectors]))})'
@@ -0,0 +1,141 @@
+class ControllerState:
+    """
+    Mirror of the state of the controller on the client side: the selected motor, the positions of the motors, the
+    exposure, the thresholds and the voltages of the detectors. It is updated by the controller after every
+    transaction from the sent commands and their results, so Motor and Detector answer repeated queries locally and
+    skip the commands, that would not change anything.
+
+    The position of a motor is unknown while it moves and after the move, until it is read from the controller: the
+    move can end earlier than planned (a limit switch, lost steps, a stop), so the position is never predicted.
+    Motor.is_moving reads the position together with the status byte, so the position at the stop is known without
+    another request. Everything
+    is forgotten after a reset of the controller, an error in the status byte, a non-zero error code of a command or
+    a failed transaction.
+    """
+    STATUS_ERROR = 0x80     # bits of the status byte of the device
+    STATUS_MOTOR = 0x01
+
+    # commands, that return an error code (zero if there is no error)
+    ERROR_CODES = {'SM', 'GI', 'GW', 'GM', 'GB', 'TS', 'ES', 'CS', 'CB', 'DS', 'DM'}
+
+    def __init__(self):
+        self.enabled = True     # if False, every query goes to the controller
+        self.skipped = {}       # {opcode: number of the commands answered locally or skipped}
+        self._handlers = {
+            'SM': self._select, 'GP': self._get_position, 'GW': self._set_position, 'GM': self._move,
+            'GI': self._move, 'RB': self._status, 'RE': self._error, 'RS': self._reset,
+            'ES': self._set_exposure, 'TS': self._set_threshold, 'TG': self._get_threshold,
+            'DS': self._set_voltage, 'DG': self._get_voltage, 'DM': self._enable_photocathode,
+        }
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Forget the whole state.
+
+        :return: None
+        """
+        self.motor = None       # selected motor
+        self.positions = {}     # {motor: position in the 2-byte counter of the controller}
+        self.exposure = None    # exposure in tenths of a second
+        self.thresholds = {}    # {(detector, threshold id): value}
+        self.voltages = {}      # {detector: voltage on the photocathode}
+        self.moving = None      # motor of the move, which has not been seen stopped yet
+
+    def update(self, op_code: str, args: tuple, result):
+        """
+        Apply the executed command to the state.
+
+        :param op_code: opcode of the command
+        :param args: arguments of the command
+        :param result: result of the command
+        :return: None
+        """
+        if op_code in self.ERROR_CODES and result:
+            self.invalidate()
+            return
+        handler = self._handlers.get(op_code)
+        if handler is not None:
+            handler(args, result)
+
+    def skip(self, op_code: str):
+        self.skipped[op_code] = self.skipped.get(op_code, 0) + 1
+
+    # queries of Motor and Detector, each returns False or None if the value is not known
+
+    def is_selected(self, motor: int) -> bool:
+        return self.enabled and self.motor == motor
+
+    def position(self):
+        """
+        :return: position of the selected motor, if it is known and the motor is not moving, else None
+        """
+        if not self.enabled or self.motor is None or self.moving == self.motor:
+            return None
+        return self.positions.get(self.motor)
+
+    def has_exposure(self, value: int) -> bool:
+        # zero exposure is always sent, as it starts the counters in the continuous mode
+        return self.enabled and value != 0 and self.exposure == value
+
+    def threshold(self, detector: int, threshold_id: int):
+        return self.thresholds.get((detector, threshold_id)) if self.enabled else None
+
+    def voltage(self, detector: int):
+        return self.voltages.get(detector) if self.enabled else None
+
+    # handlers of the commands
+
+    def _select(self, args, result):
+        self.motor = args[0]
+
+    def _get_position(self, args, result):
+        if self.motor is not None and self.moving != self.motor:
+            self.positions[self.motor] = result
+
+    def _set_position(self, args, result):
+        if self.motor is not None:
+            self.positions[self.motor] = args[0]
+
+    def _move(self, args, result):
+        self.positions.pop(self.motor, None)
+        self.moving = self.motor
+
+    def _status(self, args, result):
+        if result & self.STATUS_ERROR:
+            self.invalidate()
+        elif not result & self.STATUS_MOTOR:
+            self.moving = None
+
+    def _error(self, args, result):
+        if result:
+            self.invalidate()
+
+    def _reset(self, args, result):
+        self.invalidate()
+
+    def _set_exposure(self, args, result):
+        self.exposure = args[0]
+
+    def _set_threshold(self, args, result):
+        detector, threshold_id, value = args
+        self.thresholds[(detector, threshold_id)] = value
+
+    def _get_threshold(self, args, result):
+        self.thresholds[tuple(args)] = result
+
+    def _set_voltage(self, args, result):
+        self.voltages[args[0]] = args[1]
+
+    def _get_voltage(self, args, result):
+        self.voltages[args[0]] = result
+
+    def _enable_photocathode(self, args, result):
+        self.voltages.pop(args[0], None)    # the working or the standby voltage is set
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(motor={self.motor}, positions={self.positions}, exposure={self.exposure})'
+
+
+# state of the controller on the port shared by all the Motor and Detector objects
+STATE = ControllerState()
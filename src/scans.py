@@ -1,17 +1,33 @@
+import logging
+import math
 import os
-import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
 from multiprocessing import Pipe, Process
 from typing import Union
 
 import numpy as np
-import pandas as pd
 
+from .archive import ArchiveWriter, ArchiveIndex, archive_meta
 from .convertor import *
-from .rsm500.rsm_controller import Motor, Detector
+from .datafile import DataFileWriter
+from .file_index import FileNumberIndex
+from .fly import unwrap_counter, bin_counts
+from .planner import ScanPlan
+from .refinement import refinement_points, travel_order
+from .results import ScanResults
+from .ring_buffer import SharedRingBuffer
+from .rsm500.command import COMMANDS
+from .rsm500.interruption import CANCEL
+from .rsm500.rsm_controller import Motor, DetectorGroup
+from .timeline import ScanTimeline
 from .visualization import ScanPlotter
 
 
 class Scan:
+    MIN_SLICE = 1   # the shortest counting slice of the adaptive exposure, tenths of a second
+
     pattern = {
         'escan': 'DM',
         **dict.fromkeys(['ascan', 'rscan', 'a2scan', 'r2scan'], 'DS')
@@ -27,17 +43,24 @@ class Scan:
     def __init__(self, settings: Settings):
         # self.rsm = rsm
         self.settings = settings
+        self.file_numbers = FileNumberIndex(settings.path_to_datafiles)
         self.results = None
+        self.live_plot = True   # if False, scans run without the plot process
+        self.timeline = ScanTimeline(enabled=False)
 
+        # the speeds and the calibrations of the motors are kept only in settings.ini
+        Motor.set_speeds(settings.get_motor_speeds())
+        MotorCalibration.set_calibrations(settings.get_calibrations())
         self.motor = Motor()
 
-        self.detector_1 = Detector(COUNTER[1])
-        self.detector_2 = Detector(COUNTER[2])
+        # all the channels are read in one transaction, their order is the order of the columns of the data files
+        self.detectors = DetectorGroup(settings.detectors)
 
         self.initial_state()
 
     def initial_state(self):
-        self.results = pd.DataFrame(columns=['counter_1', 'counter_2'])
+        self.results = None
+        self.timeline = ScanTimeline(enabled=False)
         self.motor.select(4)    # remove voltage from all motors
 
     def motor_scan(self,
@@ -47,129 +70,491 @@ class Scan:
                    steps_num: int,
                    step_val: float,
                    exposure: float,
-                   motor2_id: int = None):
+                   motor2_id: int = None,
+                   plan: ScanPlan = None,
+                   rel_error: float = None):
+        """
+        Step scan: the motors stop at each point and the detectors count. The time of every point is split into
+        phases (ScanTimeline), which are saved next to the data file as DS_xxxx.timeline.tsv and summarized in the log.
+
+        If `rel_error` is given, the exposure is adaptive: each point is counted until the relative Poisson uncertainty
+        of the first detector reaches `rel_error` or the counting time reaches `exposure`, and the live time and the
+        counts per second are saved together with the counts.
+
+        :return: True if the scan was stopped
+        """
+        plan, writers, pipe, plot_process = self.start_motor_scan(scan_type, motor_id, start_val, steps_num, step_val,
+                                                                  exposure, motor2_id, plan, rel_error)
+        was_stopped = self.execute_plan(plan, exposure, pipe, writers, rel_error)
+        self.finish_motor_scan(writers, plot_process)
+
+        return was_stopped
+
+    def start_motor_scan(self, scan_type: str, motor_id: int, start_val: float, steps_num: int, step_val: float,
+                         exposure: float, motor2_id: int = None, plan: ScanPlan = None, rel_error: float = None):
+        """
+        Prepare the step scan (see motor_scan): the plan, the results, the data files, the plot and the timeline.
 
+        :return: plan, writers of the data files, pipe to the plot process and the plot process (None without a plot)
+        """
         meta = {'scan_type': scan_type,
                 'exposure': f'{exposure} s'}
+        if rel_error is not None:
+            meta.update({'mode': 'adaptive', 'exposure': f'up to {exposure} s', 'relative error': rel_error})
+        meta.update(self.detectors.metadata())
+
+        # targets of all the points and the moves between them are computed before the scan
+        if plan is None:
+            plan = ScanPlan.build(motor_id, start_val, steps_num, step_val, motor2_id)
+
+        self.results = ScanResults(steps_num, self.detectors.names, self.x_scale[motor_id],
+                                   live_time=rel_error is not None)
+        file_num = self.max_file_number(self.pattern[scan_type])
+        writers = self.data_file_writers(self.pattern[scan_type], file_num, meta, motor_id)
+
+        end_val = start_val + (steps_num - 1) * step_val
+        y_scale = 'Counts' if rel_error is None else 'CPS'
+        pipe, plot_process = self.initialize_plotter(scan_type, {'x_scale': self.x_scale[motor_id], 'y_scale': y_scale,
+                                                                 'x_range': (min(start_val, end_val),
+                                                                             max(start_val, end_val))})
+
+        self.timeline = ScanTimeline()
+        return plan, writers, pipe, plot_process
+
+    def finish_motor_scan(self, writers: list, plot_process):
+        """
+        Close the data files of the step scan, save its timeline, stop the plot and return to the initial state.
+
+        :param writers: writers of the data files
+        :param plot_process: plot process or None
+        :return: None
+        """
+        for writer in writers:
+            writer.close()
+        self.save_timeline(writers[0].path)
+
+        if plot_process is not None:
+            plot_process.terminate()
+        self.initial_state()
 
-        motor_ids = [motor_id] if motor2_id is None else [motor_id, motor2_id]
-        directions = [DIRECTION['positive'][motor] if step_val > 0 else DIRECTION['negative'][motor]
-                      for motor in motor_ids]
-        step_vals = [step_val * i for i in range(1, len(motor_ids) + 1)]   # step for the motor 2 is twice greater
+    def execute_plan(self, plan: ScanPlan, exposure: float, pipe, writers: list, rel_error: float = None) -> bool:
+        """
+        Move the motors through the points of the plan, measure and record each point. The measured point is
+        recorded, saved and plotted in a worker thread while the motors move to the next one.
+
+        :param plan: plan of the points
+        :param exposure: exposure of the point, the largest one if `rel_error` is given
+        :param pipe: pipe to the plot process or None
+        :param writers: writers of the data files
+        :param rel_error: target relative error of the adaptive exposure, None - fixed exposure
+        :return: True if the scan was stopped
+        """
+        recorder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-recorder')
+        recording = None
+
+        was_stopped = not self.run_moves(plan.approach)
+        for step_num in range(len(plan) if not was_stopped else 0):
+            if CANCEL.cancelled:
+                was_stopped = True
+                break
+            self.timeline.point = step_num
+            if rel_error is None:
+                data, live_time = self.measurement(exposure), None
+            else:
+                data, live_time = self.adaptive_measurement(exposure, rel_error) or (None, None)
 
-        self.results.index.name = self.x_scale[motor_id]
-        file_num = self.max_file_number(self.pattern[scan_type] + r'_(\d*).txt')
+            # if the measurement was interrupted - stop scan
+            if data is None:
+                was_stopped = True
+                break
 
-        pipe, plot_process = self.initialize_plotter(scan_type, {'x_scale': self.x_scale[motor_id], 'y_scale': 'Counts'})
+            if recording is not None:
+                recording.result()  # the previous point is recorded during the move, re-raise its errors if any
+            recording = recorder.submit(self.record_point, plan.positions[step_num], data, pipe, writers, live_time)
 
-        was_stopped = False
-        for step_num in range(steps_num):
-            data = self.measurement(exposure)
+            # exclude motor move from last step
+            if step_num == len(plan) - 1:
+                break
 
-            # if the measurement was interrupted - stop scan
-            if data is None:
+            self.timeline.point = step_num + 1     # the move belongs to the point, to which the motors move
+            if not self.run_moves(plan.moves[step_num]):
                 was_stopped = True
                 break
 
-            # Add obtained data to `results` attribute of the Scan object
-            value = start_val + step_num * step_val
-            self.results.loc[value] = data
+        recorder.shutdown(wait=True)
+        if recording is not None:
+            recording.result()
 
-            pipe.send(self.results)  # send results to parallel process to plot them
-            self.save_results(self.pattern[scan_type], file_num, meta)
+        return was_stopped
 
-            # exclude motor move from last step
-            if step_num == steps_num - 1:
+    def run_moves(self, moves: list) -> bool:
+        """
+        Execute the moves of a plan one after another and update the absolute positions of the motors.
+
+        :param moves: list of moves (motor, direction, steps)
+        :return: If interrupted - False, else True
+        """
+        for motor, direction, steps in moves:
+            # select the motor, read its position in the controller and start moving in one transaction
+            start = time.monotonic()
+            bucket_pos_before_moving = self.motor.select_and_move(motor, direction, steps)
+            expected_end = self.motor.expected_end(self.motor._move)
+            is_moved = self.motor.is_moving()
+            self.add_move_phases(start, expected_end)
+
+            # if the motor moving was interrupted - stop scan
+            if not is_moved:
+                if motor != MOTOR_0:
+                    delta = self.motor.get_position() - bucket_pos_before_moving
+                    self.settings.set_abs_motor_position(motor, delta)
+                return False
+
+            if motor != MOTOR_0:
+                self.settings.set_abs_motor_position(
+                    motor, steps if direction == DIRECTION['positive'][motor] else -steps)
+        return True
+
+    def add_move_phases(self, start: float, expected_end: float):
+        """
+        Add the move, that has just ended, to the timeline: it lasts until its expected end, the rest is the polling of
+        the stop.
+
+        :param start: start of the move in time.monotonic() seconds
+        :param expected_end: expected end of the move in time.monotonic() seconds
+        :return: None
+        """
+        end = time.monotonic()
+        self.timeline.add('move', start, min(max(expected_end, start), end))
+        self.timeline.add('settle', min(max(expected_end, start), end), end)
+
+    def refinement_scan(self, scan_type: str, motor_id: int, start_val: float, steps_num: int, step_val: float,
+                        exposure: float, budget: int, tolerance: float = 3., plan: ScanPlan = None):
+        """
+        Step scan with the refinement around features. After the coarse pass of `steps_num` points, the intervals with
+        a significant gradient or curvature of the counts are split in the middle, and the new points are measured in
+        one sweep of the motor; the rounds are repeated until no interval exceeds the tolerance or `budget` points are
+        added. The merged points are saved sorted by position at the end.
+
+        :param scan_type: name of the scan
+        :param motor_id: motor of the scan, it is assumed that the motor is already at `start_val`
+        :param start_val: position of the first coarse point
+        :param steps_num: number of the coarse points
+        :param step_val: step of the coarse points
+        :param exposure: exposure of each point
+        :param budget: largest number of the added points
+        :param tolerance: smallest significance of a refined interval, in Poisson standard deviations
+        :param plan: plan of the coarse pass, computed if not given
+        :return: True if the scan was stopped
+        """
+        meta = {'scan_type': scan_type,
+                'exposure': f'{exposure} s',
+                'mode': 'refinement',
+                'coarse points': steps_num,
+                'tolerance': tolerance,
+                **self.detectors.metadata()}
+
+        if plan is None:
+            plan = ScanPlan.build(motor_id, start_val, steps_num, step_val)
+
+        self.results = ScanResults(steps_num + budget, self.detectors.names, self.x_scale[motor_id])
+        end_val = start_val + (steps_num - 1) * step_val
+        pipe, plot_process = self.initialize_plotter(scan_type, {'x_scale': self.x_scale[motor_id], 'y_scale': 'Counts',
+                                                                 'x_range': (min(start_val, end_val),
+                                                                             max(start_val, end_val)),
+                                                                 'sort': True})
+
+        # positions in steps of all the planned points, the points are measured in this order
+        steps = plan.targets[:, 0]
+        was_stopped = self.execute_plan(plan, exposure, pipe, [])
+
+        while not was_stopped and len(steps) < steps_num + budget:
+            new = refinement_points(steps, self.results.counts[:self.results.size], tolerance,
+                                    steps_num + budget - len(steps))
+            if not len(new):
                 break
 
-            for motor_id, direction, step_val in zip(motor_ids, directions, step_vals):
-                self.motor.select(motor_id)
-                bucket_pos_before_moving = self.motor.get_position()    # position of the motor in the controller
-                # FIXME: if motor step will be >32768, an error will rise
-                self.motor.move(direction, to_motor_steps(motor_id, abs(step_val)))
+            new = travel_order(new, steps[-1])
+            plan = ScanPlan([motor_id], to_step_units(motor_id, new), new[:, None], start=[steps[-1]])
+            steps = np.concatenate((steps, new))
+            was_stopped = self.execute_plan(plan, exposure, pipe, [])
+
+        self.results.sort()
+        file_num = self.max_file_number(self.pattern[scan_type])
+        for writer in self.data_file_writers(self.pattern[scan_type], file_num, meta, motor_id):
+            for position, counts in zip(self.results.positions[:self.results.size].tolist(),
+                                        self.results.counts[:self.results.size].tolist()):
+                writer.write_point(position, counts)
+            writer.close()
+
+        if plot_process is not None:
+            plot_process.terminate()
+        self.initial_state()
 
-                # if the motor moving was interrupted - stop scan
-                if not self.motor.is_moving():
-                    was_stopped = True
-                    if motor_id != MOTOR_0:
-                        delta = self.motor.get_position() - bucket_pos_before_moving
-                        self.settings.set_abs_motor_position(motor_id, delta)
-                    break
+        return was_stopped
 
-                if motor_id != MOTOR_0:
-                    self.settings.set_abs_motor_position(motor_id, to_motor_steps(motor_id, step_val))
+    def fly_scan(self, scan_type: str, motor_id: int, start_val: float, steps_num: int, step_val: float,
+                 plan: ScanPlan = None):
+        """
+        Scan with a continuous move of the motor. The counters run in the continuous mode (zero exposure) while the motor
+        moves from `start_val` to `start_val + steps_num * step_val`; the position, the hardware time and the counts
+        are sampled as fast as the line allows and afterwards binned into `steps_num` intervals of `step_val`. The
+        position of the point is the center of its interval.
+
+        :param scan_type: name of the scan
+        :param motor_id: motor of the scan, it is assumed that the motor is already at `start_val`
+        :param start_val: start of the first interval
+        :param steps_num: number of the intervals
+        :param step_val: width of the interval
+        :param plan: plan of the move from the start to the end, computed if not given
+        :return: True if the scan was stopped
+        """
+        if plan is None:
+            plan = ScanPlan.build(motor_id, start_val, 2, steps_num * step_val)
+
+        self.motor.select(motor_id)
+        self.detectors.primary.set_exposure(0)     # the counters start immediately in the continuous mode
+        samples = [self.fly_sample()]
 
+        was_stopped = False
+        for _, direction, steps in plan.moves[0]:
+            self.motor.move(direction, steps)
+            move, polls = self.motor._move, 0
+            while True:
+                if CANCEL.wait(self.motor.DELAY):
+                    self.motor.stop()
+                    was_stopped = True
+                    break
+                sample = self.fly_sample()
+                samples.append(sample)
+                if not sample[-1] & 1:  # the motor has stopped
+                    break
+                polls += 1
+            samples.append(self.fly_sample())   # the position of the sample with the stop could be read before it
             if was_stopped:
                 break
+            self.motor.calibrate(move, polls)
+        self.detectors.primary.stop_count()
 
-        plot_process.terminate()
+        samples = np.array(samples, dtype=np.int64)
+        positions = unwrap_counter(samples[:, 0], 16)
+        if motor_id != MOTOR_0:
+            self.settings.set_abs_motor_position(motor_id, int(positions[-1] - positions[0]))
+
+        # progress of the move in units of the interval
+        progress = to_step_units(motor_id, positions - positions[0]) / step_val
+        times = unwrap_counter(samples[:, 1], 16) / 1000
+        counts, _ = bin_counts(progress, times, samples[:, 2:2 + len(self.detectors)], steps_num)
+
+        meta = {'scan_type': scan_type,
+                'mode': 'fly',
+                'samples': len(samples),
+                'duration': f'{times[-1] - times[0]:.3f} s',
+                **self.detectors.metadata()}
+        self.results = ScanResults(steps_num, self.detectors.names, self.x_scale[motor_id])
+        file_num = self.max_file_number(self.pattern[scan_type])
+        writers = self.data_file_writers(self.pattern[scan_type], file_num, meta, motor_id)
+
+        end_val = start_val + steps_num * step_val
+        pipe, plot_process = self.initialize_plotter(scan_type, {'x_scale': self.x_scale[motor_id], 'y_scale': 'Counts',
+                                                                 'x_range': (min(start_val, end_val),
+                                                                             max(start_val, end_val))})
+        for i, data in enumerate(counts.tolist()):
+            self.record_point(start_val + (i + 0.5) * step_val, data, pipe, writers)
+        for writer in writers:
+            writer.close()
+
+        if plot_process is not None:
+            plot_process.terminate()
         self.initial_state()
 
         return was_stopped
 
+    def fly_sample(self) -> list:
+        """
+        Read the position of the selected motor, the hardware time of the counters, the counts of all the channels and
+        the status of the device in one transaction.
+
+        :return: [position, time in ms, counts of the channels..., status]
+        """
+        return self.motor.run_batch((COMMANDS['GP'],),
+                                    (COMMANDS['EG'],),
+                                    *[(COMMANDS['CG'], detector.detector_id) for detector in self.detectors.detectors],
+                                    (COMMANDS['RB'],))
+
+    def record_point(self, value: float, data: list, pipe, writers: list, live_time: float = None):
+        """
+        Add the measured point to the results, send it to the plot process and append it to the data files.
+
+        :param value: position of the motor
+        :param data: counts of the detectors
+        :param pipe: pipe to the plot process or None
+        :param writers: writers of the data files
+        :param live_time: live time of the point, if the exposure is adaptive; the plot shows counts per second then
+        :return: None
+        """
+        point = self.results.size
+        with self.timeline.phase('storage', point):
+            self.results.append(value, data, live_time)
+        if pipe is not None:
+            with self.timeline.phase('plot', point):
+                # send the new point to parallel process to plot it
+                pipe.send((value, *data) if live_time is None else (value, *[counts / live_time for counts in data]))
+        with self.timeline.phase('file', point):
+            values = self.results.file_values(data, live_time)
+            for writer in writers:
+                writer.write_point(value, values)
+
     def eff(self):
         pass
 
-    def manual_scan(self, exposure: float, time_steps_on_plot: int):
+    def manual_scan(self, exposure: float, time_steps_on_plot: int, points: int = 0):
         # TODO: add parameters to settings
-        meta = {'scan_type': 'mscan'}
-        self.results = pd.DataFrame(data=[*np.zeros((time_steps_on_plot, 2))], columns=['counter_1', 'counter_2'])
-        self.results.index = np.arange(-time_steps_on_plot * exposure, 0, exposure)
-        pipe, plot_process = self.initialize_plotter(meta['scan_type'], {'x_scale': 'time [sec]', 'y_scale': 'CPS'})
-
-        elapsed_time = 0
-        while True:
-            data = self.measurement(exposure)
+        plot_process = self.start_manual_scan(time_steps_on_plot)
+        try:
+            elapsed_time = 0
+            for _ in count() if not points else range(points):     # endless loop if number of points is not set
+                if CANCEL.cancelled:
+                    break
+                data = self.measurement(exposure)
 
-            if data is None:
-                break
+                if data is None:
+                    break
 
-            self.results.loc[elapsed_time] = list(map(lambda x: x / exposure, data))    # data in counts per second
-            self.results.drop([self.results.index[0]], inplace=True)
-            pipe.send(self.results)
-            elapsed_time += exposure
+                self.results.append((elapsed_time, *(data / exposure)))    # counts per second
+                elapsed_time += exposure
+        finally:
+            self.finish_manual_scan(plot_process)
 
-        plot_process.terminate()
         self.initial_state()
 
-    @staticmethod
-    def initialize_plotter(scan_mode: str, scales: dict) -> Pipe and Process:
+    def start_manual_scan(self, time_steps_on_plot: int):
+        """
+        Prepare the manual scan: the window of the plot is kept in shared memory, the plot process reads it directly.
+
+        :param time_steps_on_plot: number of the points in the window of the plot
+        :return: plot process or None
+        """
+        self.results = SharedRingBuffer(time_steps_on_plot, 1 + len(self.detectors))
+        _, plot_process = self.initialize_plotter('mscan', {'x_scale': 'time [sec]', 'y_scale': 'CPS'},
+                                                  window=time_steps_on_plot, ring_name=self.results.name)
+        return plot_process
+
+    def finish_manual_scan(self, plot_process):
+        if plot_process is not None:
+            plot_process.terminate()
+        self.results.close()
+
+    def initialize_plotter(self, scan_mode: str, scales: dict, window: int = None,
+                           ring_name: str = None) -> Pipe and Process:
+        if not self.live_plot:
+            return None, None
+
         data_pipe, plot_pipe = Pipe()
         plotter = ScanPlotter()
-        plot_process = Process(target=plotter, args=(plot_pipe, scan_mode, scales), daemon=True)
+        plot_process = Process(target=plotter, args=(plot_pipe, scan_mode, scales, window, len(self.detectors),
+                                                     ring_name), daemon=True)
         plot_process.start()
 
         return data_pipe, plot_process
 
     def measurement(self, exposure: Union[int, float]):
-        self.detector_1.set_exposure(int(exposure * 10))
-        self.detector_1.start_count()
-        if self.detector_1.is_counting():  # if the measurement was not interrupted, return the data obtained
-            return [self.detector_1.read_detector_count(), self.detector_2.read_detector_count()]
+        with self.timeline.phase('counting'):
+            self.detectors.primary.start_exposure(int(exposure * 10))
+            is_counted = self.detectors.primary.is_counting()
+        if is_counted:  # if the measurement was not interrupted, return the data obtained
+            with self.timeline.phase('readout'):
+                return self.detectors.read_counts()
         return None
 
-    def max_file_number(self, pattern: str):
-        # list of all .txt files in the directory with data files
-        # data_files = list(filter(lambda f: '.txt' in f, os.listdir(self.settings.path_for_files_save)))
-        data_files = [f for f in os.listdir(self.settings.path_to_datafiles) if f.endswith('.txt')]
-        # list of file numbers
-        # nums_list = list(map(lambda f: re.findall(pattern, f), data_files))
-        # nums_list = [int(el[0]) for el in nums_list if len(el) > 0]
-        nums_list = [int(re.findall(pattern, f)[0]) for f in data_files if re.findall(pattern, f)]
+    def adaptive_measurement(self, max_exposure: float, rel_error: float):
+        """
+        Count in slices until the counts of the first detector reach the relative Poisson uncertainty `rel_error`
+        (1 / sqrt(N) <= rel_error) or the counting time reaches `max_exposure`. The first slice is MIN_SLICE, the next
+        ones are estimated from the count rate measured so far, so a point usually takes two or three slices.
+
+        :param max_exposure: largest counting time of the point in seconds
+        :param rel_error: target relative uncertainty
+        :return: counts of the detectors and the live time in seconds, or None if the measurement was interrupted
+        """
+        target = 1 / rel_error ** 2
+        limit = int(round(max_exposure * 10))   # in tenths of a second, as the exposure of the controller
+        counts, live = np.zeros(len(self.detectors), dtype=np.int64), 0
+
+        while live < limit:
+            exposure = self.next_slice(counts[0], live, target, limit)
+
+            with self.timeline.phase('counting'):
+                self.detectors.primary.start_exposure(exposure)
+                is_counted = self.detectors.primary.is_counting()
+            if not is_counted:
+                return None
+            with self.timeline.phase('readout'):
+                counts = counts + self.detectors.read_counts()
+            live += exposure
+
+            if counts[0] >= target:
+                break
 
-        return max(nums_list) if nums_list else 0
+        return counts, live / 10
+
+    @classmethod
+    def next_slice(cls, counts: int, live: int, target: float, limit: int) -> int:
+        """
+        :param counts: counts of the first detector so far
+        :param live: counting time so far, tenths of a second
+        :param target: counts, at which the relative error is reached
+        :param limit: largest counting time of the point, tenths of a second
+        :return: exposure of the next slice of the adaptive measurement, tenths of a second
+        """
+        if counts > 0:
+            needed = math.ceil((target - counts) * live / counts)   # at the rate measured so far
+        else:
+            needed = max(live, cls.MIN_SLICE)   # doubling the time while nothing is counted
+        return min(max(needed, cls.MIN_SLICE), limit - live)
+
+    def save_timeline(self, data_file: str):
+        """
+        Save the timeline of the scan next to its data file and log its summary.
+
+        :param data_file: path to the data file of the scan
+        :return: None
+        """
+        if not self.timeline.enabled or not os.path.exists(data_file):   # no point was measured
+            return
+        with self.file_numbers.writing():
+            self.timeline.save(ScanTimeline.path_for(data_file))
+        logging.getLogger().info(f'Timeline of {os.path.basename(data_file)}: {self.timeline.summary()}')
+
+    def max_file_number(self, file_symbol: str) -> int:
+        # the number is taken from the index of the directory, the directory is listed only if the index is stale
+        return self.file_numbers.last_number(file_symbol)
 
-    def save_results(self, file_symbol: str, file_num: int, meta_data: dict):
+    @staticmethod
+    def data_file_name(file_symbol: str, file_num: int) -> str:
         # form new file name: DM_{four digits}.txt, for example: DM_0012.txt
-        new_file = f'{file_symbol}_{str.zfill(str(file_num + 1), 4)}.txt'
-
-        # save metadata at the header of the file
-        with open(self.settings.path_to_datafiles + new_file, 'w') as file:
-            for key, value in meta_data.items():
-                file.write(f'# {key}:\t{value}\n')   # definition of metadata string style
-            file.write('\n')
-
-        self.results.to_csv(self.settings.path_to_datafiles + new_file,
-                            sep='\t',
-                            mode='a',
-                            float_format='%.3f')
+        return f'{file_symbol}_{str.zfill(str(file_num + 1), 4)}.txt'
+
+    def data_file_writers(self, file_symbol: str, file_num: int, meta_data: dict, motor_id: int) -> list:
+        """
+        Create writers, that append the points of the scan to a new text data file and, if it is switched on in the
+        settings, to the binary archive in the 'archive' subdirectory of the data files.
+
+        :param file_symbol: prefix of the data file
+        :param file_num: number of the last data file
+        :param meta_data: metadata written to the header of the data file
+        :param motor_id: motor of the scan
+        :return: list of DataFileWriter and ArchiveWriter objects
+        """
+        file_name = self.data_file_name(file_symbol, file_num)
+        writers = [DataFileWriter(self.settings.path_to_datafiles + file_name, meta_data,
+                                  self.results.index_name, self.results.file_columns, self.settings.fsync_every,
+                                  index=self.file_numbers)]
+
+        if self.settings.binary_archive:
+            directory = os.path.join(self.settings.path_to_datafiles, 'archive')
+            os.makedirs(directory, exist_ok=True)
+            writers.append(ArchiveWriter(os.path.join(directory, file_name[:-len('.txt')] + ArchiveWriter.EXTENSION),
+                                         archive_meta(meta_data, file_num + 1, motor_id),
+                                         self.results.index_name, self.results.file_columns, self.results.file_dtypes,
+                                         index=ArchiveIndex(directory)))
+        return writers
@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+
+
+class ScanTimeline:
+    """
+    Profile of a scan: the time of every point is split into phases, each recorded with time.monotonic() timestamps
+    relative to the start of the scan.
+
+        move      - from the move command to the expected end of the move (to the point, to which the motor moves)
+        settle    - polling the motor after the expected end of the move
+        counting  - start of the exposure and waiting for its end
+        readout   - reading the counts
+        storage   - adding the point to the results
+        file      - appending the point to the data files
+        plot      - sending the point to the plot process
+
+    The last three phases run in the recorder thread, in parallel with the move to the next point.
+    """
+    PHASES = ('move', 'settle', 'counting', 'readout', 'storage', 'file', 'plot')
+    EXTENSION = '.timeline.tsv'
+
+    def __init__(self, enabled: bool = True):
+        """
+
+        :param enabled: if False, phases are not recorded
+        """
+        self.enabled = enabled
+        self.origin = time.monotonic()
+        self.events = []    # (point, phase, start, end)
+        self.point = 0      # point of the phases, for which no point is given
+
+    @contextmanager
+    def phase(self, name: str, point: int = None):
+        """
+        Record the time of the block as the phase of the point.
+
+        :param name: name of the phase
+        :param point: number of the point, the current one by default
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.events.append((self.point if point is None else point, name, start, time.monotonic()))
+
+    def add(self, name: str, start: float, end: float, point: int = None):
+        """
+        Record the phase measured outside of a block.
+
+        :param name: name of the phase
+        :param start: start of the phase in time.monotonic() seconds
+        :param end: end of the phase in time.monotonic() seconds
+        :param point: number of the point, the current one by default
+        :return: None
+        """
+        if self.enabled:
+            self.events.append((self.point if point is None else point, name, start, end))
+
+    def totals(self) -> dict:
+        """
+        :return: dict {phase: total time in seconds}
+        """
+        totals = dict.fromkeys(self.PHASES, 0.)
+        for _, name, start, end in self.events:
+            totals[name] = totals.get(name, 0.) + end - start
+        return totals
+
+    def summary(self) -> str:
+        """
+        :return: one line with the wall time of the scan, the time of every phase and the dead time (everything except
+        counting)
+        """
+        wall = max((end for *_, end in self.events), default=self.origin) - self.origin
+        totals = self.totals()
+        share = (lambda seconds: 100 * seconds / wall) if wall else (lambda seconds: 0.)
+        parts = [f'{name} {total:.2f} s ({share(total):.0f}%)' for name, total in totals.items()]
+        dead = wall - totals['counting']
+        return f'wall {wall:.2f} s, ' + ', '.join(parts) + f'; dead time {dead:.2f} s ({share(dead):.0f}%)'
+
+    def save(self, path: str):
+        """
+        Write the phases to a tab-separated file, one line per phase of a point.
+
+        :param path: path to the file
+        :return: None
+        """
+        with open(path, 'w') as file:
+            file.write('point\tphase\tstart\tend\tduration\n')
+            for point, name, start, end in sorted(self.events, key=lambda event: event[2]):
+                file.write(f'{point}\t{name}\t{start - self.origin:.6f}\t{end - self.origin:.6f}\t{end - start:.6f}\n')
+
+    @classmethod
+    def path_for(cls, data_file: str) -> str:
+        """
+        :param data_file: path to the data file, e.g. DS_0012.txt
+        :return: path to the companion file, e.g. DS_0012.timeline.tsv
+        """
+        return data_file[:-len('.txt')] + cls.EXTENSION if data_file.endswith('.txt') else data_file + cls.EXTENSION
+
+    def __len__(self):
+        return len(self.events)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(events={len(self)})'
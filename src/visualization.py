@@ -1,9 +1,21 @@
 from multiprocessing import Pipe
 
 import matplotlib.pyplot as plt
+import numpy as np
+
+from .ring_buffer import SharedRingBuffer
 
 
 class ScanPlotter:
+    """
+    Live plot of a scan in a separate process. The scan sends through the pipe only new points as tuples
+    (x, counts_1, counts_2, ...) and None at the end. The plotter keeps the data and one persistent line per detector,
+    merges all the points received between two timer ticks into one redraw and uses blitting if the backend supports
+    it, so the cost of a redraw does not grow with the number of received messages.
+
+    For mscan the points are not sent through the pipe: the plotter reads the window directly from a shared-memory
+    ring buffer and shows no more than MAX_PLOT_POINTS of it.
+    """
     font_sizes = {
         'axis': 22,
         'title': 26,
@@ -12,35 +24,157 @@ class ScanPlotter:
     }
 
     Y_MARGIN = 0.05
+    Y_GROWTH = 1.25     # the upper limit of the y-axis is raised with a reserve to avoid full redraws
+    COLORS = ['g', 'r', 'b', 'm', 'c', 'k']
+    MAX_PLOT_POINTS = 2000  # larger windows of the ring buffer are decimated for display
 
     @staticmethod
     def terminate():
         plt.close('all')
 
     def update_plot(self):
+        rows = []
         while self.pipe.poll():
-            df = self.pipe.recv()
-            if df is None:
+            row = self.pipe.recv()
+            if row is None:
                 self.terminate()
                 return False
-            else:
-                self.axs[0].plot(df.index, df.iloc[:, 1], 'r-', label='Detector 2')
-                self.axs[0].plot(df.index, df.iloc[:, 0], 'g-', label='Detector 1')
+            rows.append(row)
 
-                if df.shape[0] == 1:
-                    continue
+        if self.ring is not None:
+            x, y = self._read_ring()
+            if x is None:
+                return True
+        elif rows:
+            self._extend(np.asarray(rows, dtype=float))
+            start = 0 if self.window is None else max(0, self.size - self.window)
+            x, y = self.x[start:self.size], self.y[start:self.size]
+            if self.sort:
+                order = np.argsort(x, kind='stable')
+                x, y = x[order], y[order]
+        else:
+            return True
 
-                # self.axs[0].autoscale()
-                self.axs[0].set_xlim([df.index[0], df.index[-1]])
-                # if not df.iloc[1].min() == df.iloc[1].max():
-                #     self.axs[0].set_ylim([0 - (1 + self.Y_MARGIN) * df.iloc[1].min(),
-                #                           df.iloc[1].max() * (1 + self.Y_MARGIN)])
+        for i, line in enumerate(self.lines):
+            line.set_data(x, y[:, i])
 
-        self.figure.canvas.draw()
+        if self._update_limits(x, y) or self.background is None:
+            self.figure.canvas.draw()   # full redraw, the background for blitting is captured in `_on_draw`
+        else:
+            self._blit()
         return True
 
-    def __call__(self, pipe: Pipe, scan_mode: str, scales: dict):
+    def _extend(self, rows: np.ndarray):
+        """
+        Add the received rows to the data arrays. The arrays grow by doubling; if the number of shown points is limited,
+        only the last `window` points are moved to the beginning of the arrays when they are full.
+
+        :param rows: array of shape (number of rows, 1 + number of detectors)
+        :return: None
+        """
+        if self.x is None:
+            self.x = np.empty(max(64, 2 * len(rows)))
+            self.y = np.empty((len(self.x), rows.shape[1] - 1))
+
+        if self.size + len(rows) > len(self.x):
+            keep = self.size if self.window is None else min(self.size, self.window)
+            if self.window is None:
+                capacity = 2 * (keep + len(rows))
+            else:
+                capacity = max(len(self.x), 2 * (self.window + len(rows)))
+            x, y = np.empty(capacity), np.empty((capacity, self.y.shape[1]))
+            x[:keep], y[:keep] = self.x[self.size - keep:self.size], self.y[self.size - keep:self.size]
+            self.x, self.y, self.size = x, y, keep
+
+        self.x[self.size:self.size + len(rows)] = rows[:, 0]
+        self.y[self.size:self.size + len(rows)] = rows[:, 1:]
+        self.size += len(rows)
+
+    def _read_ring(self):
+        """
+        Read the window from the ring buffer, if new rows were written since the last reading. The rows are decimated
+        with a stride, that is aligned to the number of written rows, so the shown points do not jump between updates.
+
+        :return: x and y arrays or None, None
+        """
+        cursor = self.ring.cursor
+        if cursor == self.ring_cursor or cursor == 0:
+            return None, None
+        self.ring_cursor = cursor
+
+        data = self.ring.snapshot()
+        stride = -(-len(data) // self.MAX_PLOT_POINTS)
+        if stride > 1:
+            data = data[(len(data) - cursor) % stride::stride]
+        return data[:, 0], data[:, 1:]
+
+    def _update_limits(self, x: np.ndarray, y: np.ndarray) -> bool:
+        """
+        Change limits of the axes if the data go beyond them.
+
+        :return: True if the limits were changed
+        """
+        ax = self.axs[0]
+        changed = False
+
+        if self.x_range is None and len(x) > 1:
+            x_lim = (x.min(), x.max()) if self.window is None else (x[0], x[-1])
+            if x_lim != ax.get_xlim():
+                ax.set_xlim(x_lim)
+                changed = True
+
+        y_min, y_max = ax.get_ylim()
+        data_max = y.max()
+        if data_max > y_max or (self.window is not None and data_max < y_max / self.Y_GROWTH ** 2):
+            y_max = max(data_max * self.Y_GROWTH, 1.)
+            ax.set_ylim([-self.Y_MARGIN * y_max, y_max])
+            changed = True
+
+        return changed
+
+    def _on_draw(self, event):
+        canvas = self.figure.canvas
+        if self.blit:
+            self.background = canvas.copy_from_bbox(self.figure.bbox)
+            for line in self.lines:
+                self.axs[0].draw_artist(line)
+        else:
+            self.background = True
+
+    def _blit(self):
+        canvas = self.figure.canvas
+        if not self.blit:
+            canvas.draw_idle()
+            return
+        canvas.restore_region(self.background)
+        for line in self.lines:
+            self.axs[0].draw_artist(line)
+        canvas.blit(self.figure.bbox)
+        canvas.flush_events()
+
+    def __call__(self, pipe: Pipe, scan_mode: str, scales: dict, window: int = None, detectors: int = 2,
+                 ring_name: str = None):
+        """
+
+        :param pipe: pipe, from which the points (or only None at the end) are received
+        :param scan_mode: name of the scan
+        :param scales: dict with the labels 'x_scale' and 'y_scale', optional 'x_range' (min, max) of the scan and
+        'sort' - draw the points ordered by x, if they do not arrive in order
+        :param window: number of the last points shown on the plot, None - all
+        :param detectors: number of the detectors
+        :param ring_name: name of the shared-memory ring buffer with the points, None - points are sent by the pipe
+        :return: None
+        """
         self.pipe = pipe
+        self.window = window
+        self.ring = SharedRingBuffer(window, 1 + detectors, ring_name) if ring_name is not None else None
+        self.ring_cursor = 0
+        self.x_range = scales.get('x_range')
+        self.sort = scales.get('sort', False)
+        self.x = self.y = None
+        self.size = 0
+        self.background = None
+
         self.figure = plt.figure(figsize=(10, 8))
         self.axs = []
         self.axs.append(self.figure.add_subplot(1, 1, 1))
@@ -49,16 +183,22 @@ class ScanPlotter:
         self.axs[0].set_ylabel(scales['y_scale'], fontsize=self.font_sizes['axis'])
         self.axs[0].set_xlabel(scales['x_scale'], fontsize=self.font_sizes['axis'])
         self.axs[0].grid(True, linestyle='--')
+        self.axs[0].set_ylim([-self.Y_MARGIN, 1.])
+        if self.x_range is not None and self.x_range[0] != self.x_range[1]:
+            self.axs[0].set_xlim(self.x_range)
 
-        self.axs[0].plot([], [], 'r-', label='Detector 2')
-        self.axs[0].plot([], [], 'g-', label='Detector 1')
+        self.blit = getattr(self.figure.canvas, 'supports_blit', False)
+        self.lines = [self.axs[0].plot([], [], f'{self.COLORS[i % len(self.COLORS)]}-', label=f'Detector {i + 1}',
+                                       animated=self.blit)[0]
+                      for i in range(detectors)]
         self.axs[0].legend(fontsize=self.font_sizes['legend'])
 
         plt.xticks(fontsize=self.font_sizes['ticks'])
         plt.yticks(fontsize=self.font_sizes['ticks'])
 
+        self.figure.canvas.mpl_connect('draw_event', self._on_draw)
         timer = self.figure.canvas.new_timer(interval=100)
-        self.figure.canvas.set_window_title(f'RSM-controller: {scan_mode}')
+        self.figure.canvas.manager.set_window_title(f'RSM-controller: {scan_mode}')
         timer.add_callback(self.update_plot)
         timer.start()
 